@@ -0,0 +1,77 @@
+from collections import namedtuple
+from locale import gettext as _
+import logging
+from threading import Event, Thread
+import time
+from .linear_chart import LinearChart
+from .performance_chart import PerformanceChart
+
+AnalysisResults = namedtuple('AnalysisResults', ['test_run', 'linear_chart', 'performance_chart', 'metrics'])
+
+class AnalysisCancelled(Exception):
+    pass
+
+class AnalysisWorker:
+
+    # Builds the charts for a finished test run on a background thread.
+    # Callbacks are called from the worker thread, results are only
+    # delivered if the worker wasn't cancelled.
+
+    def __init__(self, test_run, input_values, output_values, wheel_range, minimum_level = None,
+            minimum_level_interval = None, callback = None, progress_callback = None):
+        self.test_run = test_run
+        self.input_values = input_values
+        self.output_values = output_values
+        self.wheel_range = wheel_range
+        self.minimum_level = minimum_level
+        self.minimum_level_interval = minimum_level_interval
+        self.callback = callback
+        self.progress_callback = progress_callback
+        self.cancelled = Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def is_cancelled(self):
+        return self.cancelled.is_set()
+
+    def progress(self, fraction, text):
+        if self.is_cancelled():
+            raise AnalysisCancelled()
+        if self.progress_callback is not None:
+            self.progress_callback(self, fraction, text)
+
+    def run(self):
+        start_time = time.perf_counter()
+        try:
+            results = self.analyze()
+        except AnalysisCancelled:
+            logging.debug("Analysis of test %d cancelled", self.test_run)
+            return
+        except Exception as e:
+            logging.exception("Analysis of test %d failed", self.test_run)
+            results = e
+        logging.debug("Analysis of test %d took %.1f ms", self.test_run, (time.perf_counter() - start_time) * 1000)
+        if not self.is_cancelled() and self.callback is not None:
+            self.callback(self, results)
+
+    def analyze(self):
+        linear_chart = None
+        performance_chart = None
+        metrics = None
+        if self.test_run == 1:
+            self.progress(0, _('Analyzing linear response'))
+            linear_chart = LinearChart(self.input_values, self.output_values, self.wheel_range)
+            linear_chart.set_minimum_level(self.minimum_level, self.minimum_level_interval)
+        elif self.test_run == 2:
+            self.progress(0, _('Filtering step response'))
+            performance_chart = PerformanceChart(self.input_values, self.output_values, self.wheel_range)
+            self.progress(0.7, _('Computing metrics'))
+            metrics = performance_chart.get_metrics()
+        self.progress(1, _('Done'))
+        return AnalysisResults(self.test_run, linear_chart, performance_chart, metrics)
@@ -3,14 +3,16 @@ from locale import gettext as _
 import logging
 import os
 import subprocess
-from .device_manager import DeviceManager
+from .daemon_client import DaemonClient
 from .model import Model
+from .startup_timer import StartupTimer
 import sys
 from xdg.BaseDirectory import save_config_path
 
 class Application:
 
     def __init__(self, version, pkgdatadir, icondir):
+        self.startup_timer = StartupTimer()
         self.version = version
         self.datadir = pkgdatadir
         self.icondir = icondir
@@ -44,6 +46,7 @@ class Application:
                 help=_("don't run command manually"))
         parser.add_argument('-p', '--profile', help=_("load settings from a profile"))
         parser.add_argument('-g', '--gui', action='store_true', help=_("start the GUI"))
+        parser.add_argument('--daemon', action='store_true', help=_("run in the background applying profiles"))
         parser.add_argument('--debug', action='store_true', help=_("enable debug output"))
         parser.add_argument('--version', action='store_true', help=_("show version"))
 
@@ -56,11 +59,32 @@ class Application:
 
         if args.debug:
             argc -= 1
+            logging.basicConfig(level=logging.DEBUG)
         else:
             logging.disable(level=logging.INFO)
 
+        if args.daemon:
+            from .daemon import Daemon
+            return Daemon(self).run()
+
+        if args.profile is not None:
+            profile_file = os.path.join(self.profile_path, args.profile + '.ini')
+            if not os.path.exists(profile_file):
+                print(_("This profile doesn't exist."))
+                exit(-1)
+
+        start_gui = args.gui or argc - (1 if args.device is not None else 0) == 0
+        if not start_gui and self.run_client(args):
+            return
+
+        if not start_gui and self.run_oneshot(args):
+            logging.debug("One-shot command finished %.1f ms after exec", self.startup_timer.elapsed() * 1000)
+            return
+
+        from .device_manager import DeviceManager
         self.device_manager = DeviceManager()
         self.device_manager.start()
+        self.startup_timer.mark('device probe')
 
         if args.list:
             argc -= 1
@@ -70,17 +94,6 @@ class Application:
                 print("  {}: {}".format(device.dev_name, device.name))
             exit(0)
 
-        if args.profile is not None:
-            profile_file = os.path.join(self.profile_path, args.profile + '.ini')
-            if not os.path.exists(profile_file):
-                print(_("This profile doesn't exist."))
-                exit(-1)
-
-        if args.device is not None:
-            argc -= 1
-
-        start_gui = args.gui or argc == 0
-
         device = None
         if args.device is not None:
             if os.path.exists(args.device):
@@ -101,7 +114,20 @@ class Application:
             print(_("No device available."))
 
         model = Model(device)
+        self.load_settings(model, args)
+
+        if start_gui:
+            self.args = args
+            from oversteer.gui import Gui
+            self.startup_timer.mark('GUI imports')
+            Gui(self, model, argv)
+            return
+
+        model.flush_device()
+        if args.command:
+            subprocess.Popen(args.command, shell=True)
 
+    def load_settings(self, model, args):
         if args.profile is not None:
             profile_file = os.path.join(self.profile_path, args.profile + '.ini')
             model.load(profile_file)
@@ -126,13 +152,84 @@ class Application:
         if args.center_wheel is not None:
             model.set_center_wheel(1 if args.center_wheel else 0)
 
-        if start_gui:
-            self.args = args
-            from oversteer.gui import Gui
-            Gui(self, model, argv)
-            return
+    def run_oneshot(self, args):
+        # Lists devices or applies settings through sysfs without starting
+        # the udev monitor or probing input devices. Returns False when the
+        # full device path is needed.
+        from .oneshot import OneShot, WheelLookup
+
+        lookup = WheelLookup()
+        if args.list:
+            print(_("Devices found:"))
+            for wheel in lookup.find_wheels():
+                print("  {}: {}".format(wheel['dev_name'], wheel['name']))
+            return True
+
+        if args.device is not None:
+            if not os.path.exists(args.device):
+                return False
+            wheel = lookup.find_wheel(os.path.realpath(args.device))
+        else:
+            wheel = lookup.find_wheel()
+        if wheel is None:
+            return False
+
+        model = Model()
+        self.load_settings(model, args)
+        settings = {key: model.data[key] for key in Model.device_setters}
+
+        oneshot = OneShot(wheel)
+        try:
+            writes = oneshot.plan(settings)
+            if writes is None:
+                return False
+            oneshot.apply(writes)
+        except OSError as e:
+            # Let the full path report permission problems
+            logging.debug("run_oneshot: %s", e)
+            return False
+        finally:
+            oneshot.close()
 
-        model.flush_device()
         if args.command:
             subprocess.Popen(args.command, shell=True)
+        return True
+
+    def run_client(self, args):
+        client = DaemonClient()
+        if not client.connect():
+            return False
+
+        logging.debug("Using daemon at %s", client.path)
+
+        if args.list:
+            response = client.request('list')
+            client.close()
+            print(_("Devices found:"))
+            for device in response.get('devices', []):
+                print("  {}: {}".format(device['dev_name'], device['name']))
+            exit(0)
 
+        device = None
+        if args.device is not None:
+            if not os.path.exists(args.device):
+                print(_("No device available."))
+                exit(-1)
+            device = os.path.realpath(args.device)
+
+        settings = {}
+        for key in ['mode', 'range', 'combine_pedals', 'autocenter', 'ff_gain', 'spring_level', 'damper_level',
+                'friction_level', 'ffb_leds', 'center_wheel']:
+            value = getattr(args, key)
+            if value is not None:
+                settings[key] = value
+
+        response = client.request('apply', device=device, profile=args.profile, settings=settings)
+        client.close()
+        if 'error' in response:
+            print(response['error'])
+            exit(-1)
+
+        if args.command:
+            subprocess.Popen(args.command, shell=True)
+        return True
@@ -0,0 +1,38 @@
+from evdev import ecodes
+import numpy as np
+import time
+
+class AxisState:
+
+    # Single writer (the input reader), any number of readers. The sequence
+    # number is odd while an update is in progress; readers retry until they
+    # see the same even number before and after copying.
+
+    def __init__(self):
+        self.sequence = 0
+        self.values = np.zeros(ecodes.ABS_CNT, dtype=np.int32)
+        self.timestamp = 0.0
+
+    def update(self, events):
+        mask = events['type'] == ecodes.EV_ABS
+        if not mask.any():
+            return
+        abs_events = events[mask]
+        self.sequence += 1
+        self.values[abs_events['code']] = abs_events['value']
+        self.timestamp = float(abs_events['sec'][-1]) + abs_events['usec'][-1] / 1000000
+        self.sequence += 1
+
+    def snapshot(self):
+        while True:
+            sequence = self.sequence
+            if sequence & 1:
+                time.sleep(0)
+                continue
+            values = self.values.copy()
+            timestamp = self.timestamp
+            if sequence == self.sequence:
+                return values, timestamp
+
+    def get(self, code):
+        return int(self.values[code])
@@ -0,0 +1,165 @@
+from evdev import ecodes
+import fcntl
+import gc
+import logging
+import numpy as np
+import os
+import select
+import struct
+from threading import Thread
+import time
+from .device import Device
+from .effect_scheduler import monotonic_time
+
+# _IOW('E', 0xa0, int)
+EVIOCSCLOCKID = 0x400445a0
+
+class Capture:
+
+    capacity = 1 << 16
+    late_threshold = 0.005
+    poll_interval = 0.1
+    realtime_priority = 10
+
+    def __init__(self, device, code = ecodes.ABS_X, cpu = None, realtime = False):
+        self.device = device
+        self.code = code
+        self.cpu = cpu
+        self.realtime = realtime
+        self.clock_offset = 0.0
+        self.times = np.zeros(self.capacity, dtype=np.float64)
+        self.values = np.zeros(self.capacity, dtype=np.int32)
+        self.event_buffer = np.zeros(Device.event_buffer_size, dtype=Device.event_dtype)
+        self.count = 0
+        self.dropped = 0
+        self.late = 0
+        self.max_latency = 0.0
+        self.fd = None
+        self.thread = None
+        self.running = False
+        self.gc_was_enabled = False
+        self.regrab = False
+
+    def start(self):
+        # A second evdev client gets its own copy of every event, so the
+        # capture doesn't compete with the UI reader for the device. A
+        # grabbed device only sends events to the grabbing client, so the
+        # grab is released while capturing.
+        self.count = 0
+        self.dropped = 0
+        self.late = 0
+        self.max_latency = 0.0
+        self.fd = os.open(self.device.dev_name, os.O_RDONLY | os.O_NONBLOCK | os.O_CLOEXEC)
+        try:
+            self.set_clock()
+            self.regrab = self.device.is_grabbed()
+            if self.regrab:
+                self.device.ungrab()
+            self.running = True
+            self.gc_was_enabled = gc.isenabled()
+            gc.disable()
+            self.thread = Thread(target=self.run, daemon=True)
+            self.thread.start()
+        except BaseException:
+            self.release()
+            raise
+
+    def stop(self):
+        if self.fd is None:
+            return
+        self.release()
+        stats = self.get_stats()
+        if stats['dropped'] or stats['late']:
+            logging.warning("Capture: %d samples, %d dropped, %d late (max latency %.1f ms)",
+                    stats['samples'], stats['dropped'], stats['late'], stats['max_latency'] * 1000)
+        else:
+            logging.debug("Capture: %d samples, max latency %.1f ms", stats['samples'],
+                    stats['max_latency'] * 1000)
+
+    def release(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        os.close(self.fd)
+        self.fd = None
+        if self.gc_was_enabled:
+            gc.enable()
+            self.gc_was_enabled = False
+        if self.regrab:
+            self.regrab = False
+            try:
+                self.device.grab()
+            except OSError as e:
+                logging.debug("Capture: can't grab the device again: %s", e)
+
+    def set_clock(self):
+        # Have the kernel timestamp this client's events on CLOCK_MONOTONIC
+        try:
+            fcntl.ioctl(self.fd, EVIOCSCLOCKID, struct.pack('i', time.CLOCK_MONOTONIC))
+            self.clock_offset = 0.0
+        except OSError as e:
+            logging.debug("Capture: can't switch to CLOCK_MONOTONIC: %s", e)
+            self.clock_offset = time.clock_gettime(time.CLOCK_REALTIME) - monotonic_time()
+
+    def prepare_thread(self):
+        if self.cpu is not None:
+            try:
+                os.sched_setaffinity(0, {self.cpu})
+            except OSError as e:
+                logging.debug("Capture: can't pin to CPU %d: %s", self.cpu, e)
+        if self.realtime:
+            try:
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.realtime_priority))
+            except OSError as e:
+                logging.debug("Capture: can't use SCHED_FIFO: %s", e)
+
+    def run(self):
+        self.prepare_thread()
+        poll = select.poll()
+        poll.register(self.fd, select.POLLIN)
+        while self.running:
+            if not poll.poll(self.poll_interval * 1000):
+                continue
+            try:
+                size = os.readv(self.fd, [self.event_buffer])
+            except BlockingIOError:
+                continue
+            except OSError as e:
+                logging.debug("Capture: %s", e)
+                break
+            self.store(self.event_buffer[:size // Device.event_dtype.itemsize], monotonic_time())
+
+    def store(self, events, now):
+        if ((events['type'] == ecodes.EV_SYN) & (events['code'] == ecodes.SYN_DROPPED)).any():
+            # The kernel buffer overflowed, we can't tell how many samples were lost
+            self.dropped += 1
+        self.device.normalize_event_array(events)
+        events = events[(events['type'] == ecodes.EV_ABS) & (events['code'] == self.code)]
+        if len(events) == 0:
+            return
+
+        timestamps = events['sec'] + events['usec'] / 1000000 - self.clock_offset
+        latencies = now - timestamps
+        self.late += int(np.count_nonzero(latencies > self.late_threshold))
+        self.max_latency = max(self.max_latency, float(latencies.max()))
+
+        # Oldest samples are overwritten when the ring is full
+        positions = np.arange(self.count, self.count + len(events)) % self.capacity
+        self.times[positions] = timestamps
+        self.values[positions] = events['value']
+        self.count += len(events)
+
+    def get_stats(self):
+        return {
+            'samples': min(self.count, self.capacity),
+            'dropped': self.dropped + max(self.count - self.capacity, 0),
+            'late': self.late,
+            'max_latency': self.max_latency,
+        }
+
+    def get_data(self):
+        if self.count <= self.capacity:
+            return self.times[:self.count].copy(), self.values[:self.count].copy()
+        start = self.count % self.capacity
+        return np.roll(self.times, -start), np.roll(self.values, -start)
@@ -1,7 +1,4 @@
 from locale import gettext as _
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_gtk3cairo import FigureCanvasGTK3Cairo as FigureCanvas
-from matplotlib.backends.backend_gtk3 import NavigationToolbar2GTK3 as NavigationToolbar
 
 class CombinedChart:
 
@@ -10,11 +7,15 @@ class CombinedChart:
         self.performance_chart = performance_chart
 
     def get_canvas(self):
+        # matplotlib takes a while to load, wait until a chart is shown
+        import matplotlib.pyplot as plt
+        from matplotlib.backends.backend_gtk3cairo import FigureCanvasGTK3Cairo as FigureCanvas
+
         fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2)
 
         ax1.title.set_text(_('Linear response test'))
-        p11, = ax1.plot(*zip(*self.linear_chart.get_fixed_input_values()), label=_('Input force'), color='blue')
-        p12, = ax1.plot(*zip(*self.linear_chart.get_linearity_values()), label=_('Output force'), color='purple')
+        p11, = ax1.plot(*self.linear_chart.get_fixed_input_values(), label=_('Input force'), color='blue')
+        p12, = ax1.plot(*self.linear_chart.get_linearity_values(), label=_('Output force'), color='purple')
         ax1.set_ylabel(_('Force level'))
         ax1.grid(True)
 
@@ -22,11 +23,11 @@ class CombinedChart:
 
         ax3b = ax3.twinx()
         ax3.title.set_text(_('Step test (angular velocity + position)'))
-        p31, = ax3.step(*zip(*self.performance_chart.get_input_values()), label=_('Input force'), color='blue')
-        p32, = ax3.step(*zip(*self.performance_chart.get_pos_values()), label=_('Angular displacement (raw)'), color='yellow')
-        p33, = ax3.plot(*zip(*self.performance_chart.get_filtered_pos_values()), label=_('Angular displacement (smoothed)'), color='darkorange')
-        p34, = ax3b.plot(*zip(*self.performance_chart.get_velocity_values()), label=_('Angular velocity (raw)'), color='lightgreen')
-        p35, = ax3b.plot(*zip(*self.performance_chart.get_filtered_velocity_values()), label=_('Angular velocity (smoothed)'), color='green')
+        p31, = ax3.step(*self.performance_chart.get_input_values(), label=_('Input force'), color='blue')
+        p32, = ax3.step(*self.performance_chart.get_pos_values(), label=_('Angular displacement (raw)'), color='yellow')
+        p33, = ax3.plot(*self.performance_chart.get_filtered_pos_values(), label=_('Angular displacement (smoothed)'), color='darkorange')
+        p34, = ax3b.plot(*self.performance_chart.get_velocity_values(), label=_('Angular velocity (raw)'), color='lightgreen')
+        p35, = ax3b.plot(*self.performance_chart.get_filtered_velocity_values(), label=_('Angular velocity (smoothed)'), color='green')
         ax3.set_xlabel(_('Time (s)'))
         ax3.set_ylabel(_('Position'))
         ax3b.set_ylabel(_('RPM'))
@@ -36,9 +37,9 @@ class CombinedChart:
 
         ax4b = ax4.twinx()
         ax4.title.set_text(_('Step test (angular acceleration)'))
-        p41, = ax4.step(*zip(*self.performance_chart.get_input_values()), label=_('Input Force'), color='blue')
-        p42, = ax4b.plot(*zip(*self.performance_chart.get_accel_values()), label=_('Angular acceleration (raw)'), color='orange')
-        p43, = ax4b.plot(*zip(*self.performance_chart.get_filtered_accel_values()), label=_('Angular acceleration (smoothed)'), color='red')
+        p41, = ax4.step(*self.performance_chart.get_input_values(), label=_('Input Force'), color='blue')
+        p42, = ax4b.plot(*self.performance_chart.get_accel_values(), label=_('Angular acceleration (raw)'), color='orange')
+        p43, = ax4b.plot(*self.performance_chart.get_filtered_accel_values(), label=_('Angular acceleration (smoothed)'), color='red')
         ax4.set_xlabel(_('Time (s)'))
         ax4b.set_ylabel(_('RPM/s'))
         ax4b.tick_params(axis='y', labelcolor='red')
@@ -58,17 +59,18 @@ class CombinedChart:
             _('Estimated SNR = {:.0f} dB'),
             _('Min. force level = {:.1f} %'),
         ]
+        metrics = self.performance_chart.get_metrics()
         values = [
-            self.performance_chart.get_latency() * 1000,
-            self.performance_chart.get_max_velocity(),
-            self.performance_chart.get_mean_accel(),
-            self.performance_chart.get_mean_decel(),
-            self.performance_chart.get_max_accel(),
-            self.performance_chart.get_time_to_max_accel() * 1000,
-            self.performance_chart.get_max_decel(),
-            self.performance_chart.get_time_to_max_decel() * 1000,
-            self.performance_chart.get_residual_decel(),
-            self.performance_chart.get_estimated_snr(),
+            metrics.latency * 1000,
+            metrics.max_velocity,
+            metrics.mean_accel,
+            metrics.mean_decel,
+            metrics.max_accel,
+            metrics.time_to_max_accel * 1000,
+            metrics.max_decel,
+            metrics.time_to_max_decel * 1000,
+            metrics.residual_decel,
+            metrics.estimated_snr,
             self.linear_chart.get_minimum_level_percent(),
         ]
         ax2.text(0, 0.9, '\n'.join(text).format(*values), transform=ax2.transAxes, fontsize=10, verticalalignment='top', bbox=props)
@@ -85,6 +87,7 @@ class CombinedChart:
         return canvas
 
     def get_navigation_toolbar(self, canvas, window):
+        from matplotlib.backends.backend_gtk3 import NavigationToolbar2GTK3 as NavigationToolbar
         return NavigationToolbar(canvas, window)
 
     def align_yaxis(self, ax1, v1, ax2, v2):
@@ -0,0 +1,235 @@
+import configparser
+import json
+from locale import gettext as _
+import logging
+import os
+from queue import Queue
+import socket
+import socketserver
+from threading import Lock, RLock, Thread
+import time
+from xdg.BaseDirectory import save_config_path
+from .daemon_client import socket_path
+from .device_manager import DeviceManager
+from .model import Model
+
+class Daemon:
+
+    def __init__(self, application):
+        self.app = application
+        self.device_manager = None
+        self.server = None
+        self.path = socket_path()
+        self.config_file = os.path.join(save_config_path('oversteer'), 'daemon.ini')
+        self.models = {}
+        self.applied = set()
+        # The lock only guards models and applied, hardware writes hold
+        # write_lock so a mode switch never blocks device notifications
+        self.lock = RLock()
+        self.write_lock = Lock()
+        self.device_queue = Queue()
+
+    def run(self):
+        if not self.prepare_socket():
+            print(_("Oversteer daemon is already running."))
+            return -1
+
+        self.device_manager = DeviceManager()
+        self.device_manager.start()
+        Thread(target=self.run_device_worker, name='Daemon devices', daemon=True).start()
+        self.device_manager.add_listener(self.on_devices_changed)
+        self.on_devices_changed()
+
+        daemon = self
+
+        class RequestHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        request = json.loads(line)
+                        response = daemon.handle_request(request)
+                    except Exception as e:
+                        logging.debug("Daemon request failed: %s", e)
+                        response = {'error': str(e)}
+                    self.wfile.write(json.dumps(response).encode() + b'\n')
+                    self.wfile.flush()
+
+        self.server = socketserver.ThreadingUnixStreamServer(self.path, RequestHandler)
+        self.server.daemon_threads = True
+        os.chmod(self.path, 0o600)
+        logging.debug("Daemon listening on %s", self.path)
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server.server_close()
+            os.unlink(self.path)
+            self.device_manager.stop()
+        return 0
+
+    def prepare_socket(self):
+        if not os.path.exists(self.path):
+            return True
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+            return False
+        except OSError:
+            # Stale socket left by a daemon that didn't exit cleanly
+            os.unlink(self.path)
+            return True
+        finally:
+            sock.close()
+
+    def load_default_profiles(self):
+        config = configparser.ConfigParser(delimiters=('=',))
+        config.read(self.config_file)
+        if 'profiles' not in config:
+            return {}
+        return dict(config['profiles'])
+
+    def get_default_profile(self, device):
+        profiles = self.load_default_profiles()
+        profile_name = profiles.get(device.usb_id, profiles.get('default'))
+        if not profile_name:
+            return None
+        profile_file = os.path.join(self.app.profile_path, profile_name + '.ini')
+        if not os.path.exists(profile_file):
+            logging.warning("Default profile not found: %s", profile_file)
+            return None
+        return profile_file
+
+    @staticmethod
+    def model_key(device):
+        return device.phys_path if device.phys_path is not None else device.get_id()
+
+    def get_model(self, device):
+        key = self.model_key(device)
+        model = self.models.get(key)
+        if model is None:
+            model = Model(device)
+            profile_file = self.get_default_profile(device)
+            if profile_file is not None:
+                model.load(profile_file)
+            self.models[key] = model
+        elif model.get_device() is not device or device.get_id() not in self.applied:
+            # Re-enumerated device, keep the settings we applied before
+            model.set_device(device)
+        return model
+
+    def on_devices_changed(self):
+        self.device_queue.put(None)
+
+    def run_device_worker(self):
+        while True:
+            self.device_queue.get()
+            try:
+                self.apply_default_profiles()
+            except Exception:
+                logging.exception("Daemon: applying default profiles failed")
+
+    def apply_default_profiles(self):
+        with self.lock:
+            devices = []
+            for device in self.device_manager.get_devices():
+                if not device.is_ready():
+                    self.applied.discard(device.get_id())
+                elif device.get_id() not in self.applied:
+                    devices.append(device)
+        for device in devices:
+            start_time = time.perf_counter()
+            with self.write_lock:
+                with self.lock:
+                    if not device.is_ready() or device.get_id() in self.applied:
+                        continue
+                    model = self.get_model(device)
+                changed, device = self.write_model(model)
+            logging.debug("Daemon applied %s to %s in %.1f ms", changed, device.get_id(),
+                    (time.perf_counter() - start_time) * 1000)
+
+    def write_model(self, model):
+        # Called with write_lock held. A mode switch re-enumerates the wheel,
+        # the settings are then written again to the new device.
+        device = model.get_device()
+        changed = model.flush_device() if device.is_ready() else []
+        if not device.is_ready():
+            new_device = self.device_manager.wait_for_device(device, 0)
+            if new_device is not None:
+                with self.lock:
+                    self.applied.discard(device.get_id())
+                    self.models.pop(self.model_key(device), None)
+                    self.models[self.model_key(new_device)] = model
+                    model.set_device(new_device)
+                changed += [key for key in model.flush_device() if key not in changed]
+                device = new_device
+        if device.is_ready():
+            with self.lock:
+                self.applied.add(device.get_id())
+        return changed, device
+
+    def find_device(self, dev_name):
+        if dev_name is None:
+            device = next((item for item in self.device_manager.get_devices() if item.is_ready()), None)
+        else:
+            device = self.device_manager.get_device(dev_name)
+        if device is None or not device.is_ready():
+            raise Exception(_("No device available."))
+        return device
+
+    def handle_request(self, request):
+        command = request.get('command')
+        if command == 'list':
+            return {'devices': [
+                {'id': device.get_id(), 'dev_name': device.dev_name, 'name': device.name}
+                for device in self.device_manager.get_devices() if device.is_ready()
+            ]}
+        if command == 'get':
+            return self.get(request)
+        if command == 'apply':
+            return self.apply(request)
+        raise Exception(_("Unknown command: {}").format(command))
+
+    def get(self, request):
+        device = self.find_device(request.get('device'))
+        with self.lock:
+            model = self.models.get(self.model_key(device))
+            settings = model.data.copy() if model is not None else None
+        # The GUI, tests or other tools may have changed the wheel. The state
+        # is read without the lock so clients don't wait for an apply.
+        device_state = Model(device).data
+        if settings is None:
+            return {'settings': device_state}
+        for key in Model.device_setters:
+            settings[key] = device_state[key]
+        return {'settings': settings}
+
+    def apply(self, request):
+        with self.write_lock:
+            return self.apply_settings(request)
+
+    def apply_settings(self, request):
+        device = self.find_device(request.get('device'))
+        if not device.check_permissions():
+            raise Exception(_("You don't have the required permissions to change your wheel settings."))
+        with self.lock:
+            model = self.get_model(device)
+        profile = request.get('profile')
+        if profile is not None:
+            profile_file = os.path.join(self.app.profile_path, profile + '.ini')
+            if not os.path.exists(profile_file):
+                raise Exception(_("This profile doesn't exist."))
+            model.load(profile_file)
+        settings = request.get('settings', {})
+        for key in settings:
+            if key not in Model.device_setters:
+                raise Exception(_("Unknown setting: {}").format(key))
+        previous_data = model.data.copy()
+        for key, value in settings.items():
+            getattr(model, 'set_' + key)(value)
+        changed = [key for key in settings if model.data[key] != previous_data[key]]
+        # The model may be out of date with the wheel, flush_device compares
+        # against a fresh read so the requested settings are written anyway
+        flushed, device = self.write_model(model)
+        changed += [key for key in flushed if key not in changed]
+        return {'device': device.get_id(), 'changed': changed}
@@ -0,0 +1,48 @@
+import json
+import os
+import socket
+
+def socket_path():
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if not runtime_dir:
+        runtime_dir = '/tmp'
+    return os.path.join(runtime_dir, 'oversteer-' + str(os.getuid()) + '.sock')
+
+class DaemonClient:
+
+    timeout = 15
+
+    def __init__(self, path = None):
+        self.path = path if path is not None else socket_path()
+        self.socket = None
+        self.file = None
+
+    def connect(self):
+        if not os.path.exists(self.path):
+            return False
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            return False
+        self.socket = sock
+        self.file = sock.makefile('rwb')
+        return True
+
+    def close(self):
+        if self.socket is not None:
+            self.file.close()
+            self.socket.close()
+            self.socket = None
+            self.file = None
+
+    def request(self, command, **kwargs):
+        kwargs['command'] = command
+        self.file.write(json.dumps(kwargs).encode() + b'\n')
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            return {'error': 'Connection closed by daemon.'}
+        return json.loads(line)
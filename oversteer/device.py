@@ -1,52 +1,78 @@
 from evdev import ecodes, InputDevice
 import grp
 import logging
+import numpy as np
 import os
 import pwd
 import re
-import select
 import time
+from .axis_state import AxisState
+from .device_capabilities import DeviceCapabilities
 from . import wheel_ids as wid
 
 logging.basicConfig(level=logging.DEBUG)
 
 class Device:
 
-    last_axis_value = {
-        ecodes.ABS_X: 0,
-        ecodes.ABS_Y: 0,
-        ecodes.ABS_Z: 0,
-        ecodes.ABS_RZ: 0,
-    }
+    attributes = [
+        'alternate_modes',
+        'range',
+        'combine_pedals',
+        'gain',
+        'autocenter',
+        'spring_level',
+        'damper_level',
+        'friction_level',
+        'ffb_leds',
+        'peak_ffb_level',
+    ]
+
+    # struct input_event: struct timeval (two C longs), __u16 type, __u16 code, __s32 value
+    event_dtype = np.dtype([('sec', 'l'), ('usec', 'l'), ('type', 'u2'), ('code', 'u2'), ('value', 'i4')])
+
+    event_buffer_size = 256
+
+    mode_switch_timeout = 10
 
     def __init__(self, device_manager, data):
         self.device_manager = device_manager
         self.input_device = None
+        self.grabbed = False
         self.id = None
         self.vendor_id = None
         self.product_id = None
         self.usb_id = None
         self.dev_path = None
         self.dev_name = None
+        self.phys_path = None
         self.name = None
         self.ready = True
         self.max_range = None
+        self.attribute_fds = None
+        self.capabilities = None
+        self.normalization_plan = None
+        self.event_buffer = np.zeros(self.event_buffer_size, dtype=self.event_dtype)
+        self.axis_state = AxisState()
 
         self.set(data)
 
     def set(self, data):
         for key, value in data.items():
             setattr(self, key, value)
+        self.normalization_plan = None
 
     def close(self):
         if self.input_device is not None:
             self.input_device.close()
             self.input_device = None
+        self.grabbed = False
 
     def disable(self):
         self.dev_name = None
         self.ready = False
         self.close()
+        self.close_attributes()
+        self.capabilities = None
 
     def enable(self):
         self.ready = True
@@ -54,6 +80,28 @@ class Device:
     def is_ready(self):
         return self.ready
 
+    def check_ready(self):
+        # On success the attributes are left open for probe_input
+        if self.dev_name is None:
+            return False
+        attribute_fds = {}
+        try:
+            fd = os.open(self.dev_name, os.O_RDONLY | os.O_NONBLOCK | os.O_CLOEXEC)
+            os.close(fd)
+            for name in self.attributes:
+                path = self.device_file(name)
+                if not os.access(path, os.F_OK):
+                    continue
+                attribute_fds[name] = os.open(path, os.O_RDWR | os.O_CLOEXEC)
+                os.pread(attribute_fds[name], 4096, 0)
+        except OSError:
+            for fd in attribute_fds.values():
+                os.close(fd)
+            return False
+        self.close_attributes()
+        self.attribute_fds = attribute_fds
+        return True
+
     def get_id(self):
         return self.id
 
@@ -66,6 +114,67 @@ class Device:
             return False
         return path
 
+    def open_attributes(self):
+        self.close_attributes()
+        attribute_fds = {}
+        if self.dev_path is not None:
+            for name in self.attributes:
+                path = self.checked_device_file(name)
+                if not path:
+                    continue
+                try:
+                    attribute_fds[name] = os.open(path, os.O_RDWR | os.O_CLOEXEC)
+                except OSError as e:
+                    logging.debug("open_attributes: %s: %s", path, e)
+        self.attribute_fds = attribute_fds
+
+    def close_attributes(self):
+        attribute_fds = self.attribute_fds
+        self.attribute_fds = None
+        if attribute_fds is None:
+            return
+        for fd in attribute_fds.values():
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def probe(self):
+        self.open_attributes()
+        self.probe_input()
+
+    def probe_input(self):
+        self.capabilities = None
+        self.get_capabilities()
+        self.normalization_plan = self.build_normalization_plan()
+        self.seed_axis_state()
+
+    def get_attribute_fd(self, name):
+        if self.attribute_fds is None:
+            self.open_attributes()
+        return self.attribute_fds.get(name)
+
+    def has_attribute(self, name):
+        return self.get_attribute_fd(name) is not None
+
+    def read_attribute(self, name):
+        fd = self.get_attribute_fd(name)
+        if fd is None:
+            return None
+        try:
+            return os.pread(fd, 4096, 0).decode()
+        except OSError as e:
+            logging.debug("read_attribute: %s: %s", name, e)
+            self.close_attributes()
+            return None
+
+    def write_attribute(self, name, value):
+        fd = self.get_attribute_fd(name)
+        if fd is None:
+            return False
+        os.pwrite(fd, str(value).encode(), 0)
+        return True
+
     def check_file_permissions(self, filename):
         if filename is None:
             return True
@@ -83,11 +192,9 @@ class Device:
         return self.max_range
 
     def list_modes(self):
-        path = self.checked_device_file("alternate_modes")
-        if not path:
+        data = self.read_attribute("alternate_modes")
+        if data is None:
             return None
-        with open(path, "r") as file:
-            data = file.read()
         lines = data.splitlines()
         reg = re.compile("([^:]+): (.*)")
         alternate_modes = []
@@ -106,11 +213,9 @@ class Device:
         return alternate_modes
 
     def get_mode(self):
-        path = self.checked_device_file("alternate_modes")
-        if not path:
+        data = self.read_attribute("alternate_modes")
+        if data is None:
             return None
-        with open(path, "r") as file:
-            data = file.read()
 
         mode_id = None
         lines = data.splitlines()
@@ -126,71 +231,50 @@ class Device:
         return mode_id
 
     def set_mode(self, emulation_mode):
-        path = self.checked_device_file("alternate_modes")
-        if not path:
+        if not self.has_attribute("alternate_modes"):
             return False
         old_mode = self.get_mode()
         if old_mode == emulation_mode:
             return True
-        self.disable()
         logging.debug("Setting mode: %s", str(emulation_mode))
-        with open(path, "w") as file:
-            file.write(emulation_mode)
-        # Wait for device ready
-        for i in range(10):
-            if self.is_ready():
-                return True
-            time.sleep(1)
-        return False
+        self.write_attribute("alternate_modes", emulation_mode)
+        self.disable()
+        # Wait for the re-enumerated device to be ready
+        return self.device_manager.wait_for_device(self, self.mode_switch_timeout) is not None
 
     def get_range(self):
-        path = self.checked_device_file("range")
-        if not path:
+        data = self.read_attribute("range")
+        if data is None:
             return None
-        with open(path, "r") as file:
-            data = file.read()
-        wrange = data.strip()
-        return int(wrange)
+        return int(data.strip())
 
     def set_range(self, wrange):
-        path = self.checked_device_file("range")
-        if not path:
+        if not self.has_attribute("range"):
             return False
-        wrange = str(wrange)
         logging.debug("Setting range: %s", wrange)
-        with open(path, "w") as file:
-            file.write(wrange)
+        self.write_attribute("range", wrange)
         return True
 
     def get_combine_pedals(self):
-        path = self.checked_device_file("combine_pedals")
-        if not path:
+        data = self.read_attribute("combine_pedals")
+        if data is None:
             return None
-        with open(path, "r") as file:
-            data = file.read()
-        combine_pedals = data.strip()
-        return int(combine_pedals)
+        return int(data.strip())
 
     def set_combine_pedals(self, combine_pedals):
-        path = self.checked_device_file("combine_pedals")
-        if not path:
+        if not self.has_attribute("combine_pedals"):
             return False
-        combine_pedals = str(combine_pedals)
         logging.debug("Setting combined pedals: %s", combine_pedals)
-        with open(path, "w") as file:
-            file.write(combine_pedals)
+        self.write_attribute("combine_pedals", combine_pedals)
         return True
 
     def get_autocenter(self):
-        path = self.checked_device_file("autocenter")
-        if not path:
-            capabilities = self.get_capabilities()
-            if ecodes.EV_FF in capabilities and ecodes.FF_AUTOCENTER in capabilities[ecodes.EV_FF]:
+        data = self.read_attribute("autocenter")
+        if data is None:
+            if self.get_capabilities().has_ff_effect(ecodes.FF_AUTOCENTER):
                 return 0
             else:
                 return None
-        with open(path, "r") as file:
-            data = file.read()
         autocenter = data.strip()
         return int(round((int(autocenter) * 100) / 65535))
 
@@ -199,25 +283,18 @@ class Device:
             autocenter = 100
         autocenter = str(int(autocenter / 100.0 * 65535))
         logging.debug("Setting autocenter strength: %s", autocenter)
-        path = self.checked_device_file("autocenter")
-        if path:
-            with open(path, "w") as file:
-                file.write(autocenter)
-        else:
+        if not self.write_attribute("autocenter", autocenter):
             input_device = self.get_input_device()
             input_device.write(ecodes.EV_FF, ecodes.FF_AUTOCENTER, int(autocenter))
         return True
 
     def get_ff_gain(self):
-        path = self.checked_device_file("gain")
-        if not path:
-            capabilities = self.get_capabilities()
-            if ecodes.EV_FF in capabilities and ecodes.FF_GAIN in capabilities[ecodes.EV_FF]:
+        data = self.read_attribute("gain")
+        if data is None:
+            if self.get_capabilities().has_ff_effect(ecodes.FF_GAIN):
                 return 100
             else:
                 return None
-        with open(path, "r") as file:
-            data = file.read()
         gain = int(data.strip())
         return int(round((int(gain) * 100) / 65535))
 
@@ -226,107 +303,73 @@ class Device:
             gain = 100
         gain = str(int(gain / 100.0 * 65535))
         logging.debug("Setting FF gain: %s", gain)
-        path = self.checked_device_file("gain")
-        if path:
-            with open(path, "w") as file:
-                file.write(gain)
-        else:
+        if not self.write_attribute("gain", gain):
             input_device = self.get_input_device()
             input_device.write(ecodes.EV_FF, ecodes.FF_GAIN, int(gain))
 
     def get_spring_level(self):
-        path = self.checked_device_file("spring_level")
-        if not path:
+        data = self.read_attribute("spring_level")
+        if data is None:
             return None
-        with open(path, "r") as file:
-            data = file.read()
-        spring_level = data.strip()
-        return int(spring_level)
+        return int(data.strip())
 
     def set_spring_level(self, level):
-        path = self.checked_device_file("spring_level")
-        if not path:
+        if not self.has_attribute("spring_level"):
             return False
-        level = str(level)
         logging.debug("Setting spring level: %s", level)
-        with open(path, "w") as file:
-            file.write(level)
+        self.write_attribute("spring_level", level)
         return True
 
     def get_damper_level(self):
-        path = self.checked_device_file("damper_level")
-        if not path:
+        data = self.read_attribute("damper_level")
+        if data is None:
             return None
-        with open(path, "r") as file:
-            data = file.read()
-        damper_level = data.strip()
-        return int(damper_level)
+        return int(data.strip())
 
     def set_damper_level(self, level):
-        path = self.checked_device_file("damper_level")
-        if not path:
+        if not self.has_attribute("damper_level"):
             return False
-        level = str(level)
         logging.debug("Setting damper level: %s", level)
-        with open(path, "w") as file:
-            file.write(level)
+        self.write_attribute("damper_level", level)
         return True
 
     def get_friction_level(self):
-        path = self.checked_device_file("friction_level")
-        if not path:
+        data = self.read_attribute("friction_level")
+        if data is None:
             return None
-        with open(path, "r") as file:
-            data = file.read()
-        friction_level = data.strip()
-        return int(friction_level)
+        return int(data.strip())
 
     def set_friction_level(self, level):
-        path = self.checked_device_file("friction_level")
-        if not path:
+        if not self.has_attribute("friction_level"):
             return False
-        level = str(level)
         logging.debug("Setting friction level: %s", level)
-        with open(path, "w") as file:
-            file.write(level)
+        self.write_attribute("friction_level", level)
         return True
 
     def get_ffb_leds(self):
-        path = self.checked_device_file("ffb_leds")
-        if not path:
+        data = self.read_attribute("ffb_leds")
+        if data is None:
             return None
-        with open(path, "r") as file:
-            data = file.read()
-        ffb_leds = data.strip()
-        return int(ffb_leds)
+        return int(data.strip())
 
     def set_ffb_leds(self, ffb_leds):
-        path = self.checked_device_file("ffb_leds")
-        if not path:
+        if not self.has_attribute("ffb_leds"):
             return False
-        ffb_leds = str(ffb_leds)
         logging.debug("Setting FF leds: %s", ffb_leds)
-        with open(path, "w") as file:
-            file.write(ffb_leds)
+        self.write_attribute("ffb_leds", ffb_leds)
         return True
 
     def get_peak_ffb_level(self):
-        path = self.checked_device_file("peak_ffb_level")
-        if not path:
+        data = self.read_attribute("peak_ffb_level")
+        if data is None:
             return None
-        with open(path, "r") as file:
-            data = file.read()
-        peak_ffb_level = data.strip()
-        return int(peak_ffb_level)
+        return int(data.strip())
 
     def set_peak_ffb_level(self, peak_ffb_level):
-        path = self.checked_device_file("peak_ffb_level")
-        if not path:
+        if not self.has_attribute("peak_ffb_level"):
             return False
-        peak_ffb_level = str(peak_ffb_level)
         logging.debug("Setting peak FF level: %s", peak_ffb_level)
-        with open(path, "w") as file:
-            file.write(peak_ffb_level)
+        self.write_attribute("peak_ffb_level", peak_ffb_level)
         return True
 
     def center_wheel(self):
@@ -360,8 +403,33 @@ class Device:
             return False
         return True
 
+    def get_axis_state(self):
+        return self.axis_state
+
     def get_last_axis_value(self, axis):
-        return self.last_axis_value[axis]
+        return self.axis_state.get(axis)
+
+    def seed_axis_state(self):
+        # Start from the positions the kernel already knows about
+        axes = self.get_capabilities().get_axes()
+        if not axes:
+            return
+        events = np.zeros(len(axes), dtype=self.event_dtype)
+        events['type'] = ecodes.EV_ABS
+        events['code'] = list(axes.keys())
+        events['value'] = [absinfo.value for absinfo in axes.values()]
+        self.axis_state.update(self.normalize_event_array(events))
+
+    def grab(self):
+        self.get_input_device().grab()
+        self.grabbed = True
+
+    def ungrab(self):
+        self.get_input_device().ungrab()
+        self.grabbed = False
+
+    def is_grabbed(self):
+        return self.grabbed
 
     def get_input_device(self):
         if self.input_device is None or self.input_device.fd == -1:
@@ -370,20 +438,46 @@ class Device:
         return self.input_device
 
     def get_capabilities(self):
-        return self.get_input_device().capabilities()
-
-    def read_events(self, timeout):
+        if self.capabilities is None:
+            if self.attribute_fds is None:
+                self.open_attributes()
+            attributes = self.attribute_fds.keys()
+            try:
+                input_device = self.get_input_device() if self.dev_name is not None else None
+                self.capabilities = DeviceCapabilities(input_device, attributes)
+            except OSError as e:
+                logging.debug("get_capabilities: %s: %s", self.dev_name, e)
+                self.capabilities = DeviceCapabilities(None, attributes)
+        return self.capabilities
+
+    def get_fd(self):
+        if self.dev_name is None:
+            return None
         input_device = self.get_input_device()
-        if input_device is not None and input_device.fd != -1:
-            r, _, _ = select.select({input_device.fd: input_device}, [], [], timeout)
-            if input_device.fd in r:
-                for event in input_device.read():
-                    event = self.normalize_event(event)
-                    if event.type == ecodes.EV_ABS:
-                        self.last_axis_value[ecodes.ABS_X] = event.value
-                    yield event
-
-    def normalize_event(self, event):
+        if input_device is None or input_device.fd == -1:
+            return None
+        return input_device.fd
+
+    def read_available_events(self):
+        # Returns a view into the device's event buffer, only valid until the next call
+        fd = self.get_fd()
+        if fd is None:
+            return None
+        try:
+            size = os.readv(fd, [self.event_buffer])
+        except BlockingIOError:
+            return None
+        events = self.event_buffer[:size // self.event_dtype.itemsize]
+        self.normalize_event_array(events)
+        self.axis_state.update(events)
+        return events
+
+    def get_normalization_plan(self):
+        if self.normalization_plan is None:
+            self.normalization_plan = self.build_normalization_plan()
+        return self.normalization_plan
+
+    def build_normalization_plan(self):
         #
         # Oversteer expects axes as follows:
         #
@@ -394,62 +488,77 @@ class Device:
         # - Hat X: ABS_HAT0X [-1, 1]
         # - Hat Y: ABS_HAT0Y [-1, 1]
         #
+        # The plan maps (type, code) to (new_code, scale, offset, divisor) so that
+        # the normalized value is int((value * scale + offset) / divisor). Events
+        # without an entry are passed through unchanged.
+        #
 
-        if event.type == ecodes.EV_KEY:
-            if self.usb_id in [wid.LG_WFF]:
-                if event.code in [ecodes.BTN_GEAR_DOWN, ecodes.BTN_GEAR_UP]:
-                    event.code = event.code - ecodes.BTN_GEAR_DOWN + ecodes.BTN_TRIGGER
-
-        if event.type != ecodes.EV_ABS:
-            return event
-
-        if self.usb_id in [wid.LG_WFF]:
-            if event.code == ecodes.ABS_WHEEL:
-                event.code = ecodes.ABS_X
-                event.value = (event.value + 2048) * 16
-            elif event.code == ecodes.ABS_GAS:
-                event.code = ecodes.ABS_Z
-            elif event.code == ecodes.ABS_BRAKE:
-                event.code = ecodes.ABS_RZ
-        if event.code == ecodes.ABS_X:
-            if self.usb_id in [wid.LG_WFG, wid.LG_WFFG]:
-                event.value = event.value * 64
-            elif self.usb_id in [wid.LG_SFW, wid.LG_MOMO, wid.LG_MOMO2, wid.LG_DF, wid.LG_DFP, wid.LG_DFGT, wid.LG_G25, wid.LG_G27]:
-                event.value = event.value * 4
-            elif self.vendor_id == wid.VENDOR_CAMMUS:
-                event.value = event.value + 32768
-        elif self.usb_id in [wid.LG_WFG, wid.LG_WFFG, wid.LG_SFW, wid.LG_MOMO, wid.LG_MOMO2, wid.LG_DF, wid.LG_DFP,
+        plan = {}
+
+        def remap(codes):
+            for code, new_code in codes.items():
+                plan[(ecodes.EV_ABS, code)] = (new_code, 1, 0, 1)
+
+        if self.usb_id == wid.LG_WFF:
+            for code in [ecodes.BTN_GEAR_DOWN, ecodes.BTN_GEAR_UP]:
+                plan[(ecodes.EV_KEY, code)] = (code - ecodes.BTN_GEAR_DOWN + ecodes.BTN_TRIGGER, 1, 0, 1)
+            plan[(ecodes.EV_ABS, ecodes.ABS_WHEEL)] = (ecodes.ABS_X, 16, 2048 * 16, 1)
+            remap({
+                ecodes.ABS_GAS: ecodes.ABS_Z,
+                ecodes.ABS_BRAKE: ecodes.ABS_RZ,
+            })
+
+        if self.usb_id in [wid.LG_WFG, wid.LG_WFFG]:
+            plan[(ecodes.EV_ABS, ecodes.ABS_X)] = (ecodes.ABS_X, 64, 0, 1)
+        elif self.usb_id in [wid.LG_SFW, wid.LG_MOMO, wid.LG_MOMO2, wid.LG_DF, wid.LG_DFP, wid.LG_DFGT, wid.LG_G25,
+                wid.LG_G27]:
+            plan[(ecodes.EV_ABS, ecodes.ABS_X)] = (ecodes.ABS_X, 4, 0, 1)
+        elif self.vendor_id == wid.VENDOR_CAMMUS:
+            plan[(ecodes.EV_ABS, ecodes.ABS_X)] = (ecodes.ABS_X, 1, 32768, 1)
+
+        if self.usb_id in [wid.LG_WFG, wid.LG_WFFG, wid.LG_SFW, wid.LG_MOMO, wid.LG_MOMO2, wid.LG_DF, wid.LG_DFP,
                 wid.LG_DFGT, wid.LG_G920]:
-            if event.code == ecodes.ABS_Y:
-                event.code = ecodes.ABS_Z
-            elif event.code == ecodes.ABS_Z:
-                event.code = ecodes.ABS_RZ
-            elif event.code == ecodes.ABS_RZ:
-                event.code = ecodes.ABS_Y
+            remap({
+                ecodes.ABS_Y: ecodes.ABS_Z,
+                ecodes.ABS_Z: ecodes.ABS_RZ,
+                ecodes.ABS_RZ: ecodes.ABS_Y,
+            })
         elif self.usb_id in [wid.TM_T248, wid.TM_T150, wid.TM_TMX]:
-            if event.code == ecodes.ABS_RZ:
-                event.code = ecodes.ABS_Z
-            elif event.code == ecodes.ABS_Y:
-                event.code = ecodes.ABS_RZ
-            elif event.code == ecodes.ABS_THROTTLE:
-                event.code = ecodes.ABS_Y
-        elif self.vendor_id == wid.VENDOR_FANATEC and event.code in [ecodes.ABS_Y, ecodes.ABS_Z, ecodes.ABS_RZ]:
-            event.value = int(event.value + 32768 / 257)
+            remap({
+                ecodes.ABS_RZ: ecodes.ABS_Z,
+                ecodes.ABS_Y: ecodes.ABS_RZ,
+                ecodes.ABS_THROTTLE: ecodes.ABS_Y,
+            })
+        elif self.vendor_id == wid.VENDOR_FANATEC:
+            for code in [ecodes.ABS_Y, ecodes.ABS_Z, ecodes.ABS_RZ]:
+                plan[(ecodes.EV_ABS, code)] = (code, 257, 32768, 257)
         elif self.usb_id == wid.LG_GPRO:
-            if event.code in [ecodes.ABS_RX, ecodes.ABS_RY, ecodes.ABS_RZ]:
-                event.value = int(255 - event.value / 257)
-                if event.code == ecodes.ABS_RX:
-                    event.code = ecodes.ABS_Z
-                elif event.code == ecodes.ABS_RY:
-                    event.code = ecodes.ABS_RZ
-                elif event.code == ecodes.ABS_RZ:
-                    event.code = ecodes.ABS_Y
+            plan[(ecodes.EV_ABS, ecodes.ABS_RX)] = (ecodes.ABS_Z, -1, 255 * 257, 257)
+            plan[(ecodes.EV_ABS, ecodes.ABS_RY)] = (ecodes.ABS_RZ, -1, 255 * 257, 257)
+            plan[(ecodes.EV_ABS, ecodes.ABS_RZ)] = (ecodes.ABS_Y, -1, 255 * 257, 257)
         elif self.usb_id == wid.LG_G923X:
-            if event.code == ecodes.ABS_Y:
-                event.code = ecodes.ABS_Z
-            elif event.code == ecodes.ABS_RZ:
-                event.code = ecodes.ABS_Y
-            elif event.code == ecodes.ABS_Z:
-                event.code = ecodes.ABS_RZ
-
-        return event
+            remap({
+                ecodes.ABS_Y: ecodes.ABS_Z,
+                ecodes.ABS_RZ: ecodes.ABS_Y,
+                ecodes.ABS_Z: ecodes.ABS_RZ,
+            })
+
+        return plan
+
+    def normalize_event_array(self, events):
+        plan = self.get_normalization_plan()
+        if not plan or len(events) == 0:
+            return events
+        types = events['type'].copy()
+        codes = events['code'].copy()
+        values = events['value'].astype(np.int64)
+        for (etype, code), (new_code, scale, offset, divisor) in plan.items():
+            mask = (types == etype) & (codes == code)
+            if not mask.any():
+                continue
+            events['code'][mask] = new_code
+            value = values[mask] * scale + offset
+            if divisor != 1:
+                value = np.trunc(value / divisor)
+            events['value'][mask] = value
+        return events
@@ -0,0 +1,43 @@
+from evdev import ecodes
+
+class DeviceCapabilities:
+
+    def __init__(self, input_device, attributes):
+        self.attributes = frozenset(attributes)
+        self.ff_effects = frozenset()
+        self.axes = {}
+        self.keys = frozenset()
+        self.ff_effects_count = 0
+
+        if input_device is None:
+            return
+
+        capabilities = input_device.capabilities(absinfo=True)
+        self.ff_effects = frozenset(capabilities.get(ecodes.EV_FF, []))
+        self.axes = dict(capabilities.get(ecodes.EV_ABS, []))
+        self.keys = frozenset(capabilities.get(ecodes.EV_KEY, []))
+        self.ff_effects_count = input_device.ff_effects_count
+
+    def has_attribute(self, name):
+        return name in self.attributes
+
+    def has_ff_effect(self, effect):
+        return effect in self.ff_effects
+
+    def get_ff_effects(self):
+        return self.ff_effects
+
+    def get_ff_effects_count(self):
+        return self.ff_effects_count
+
+    def has_axis(self, code):
+        return code in self.axes
+
+    def get_axes(self):
+        return self.axes
+
+    def get_absinfo(self, code):
+        return self.axes.get(code)
+
+    def get_keys(self):
+        return self.keys
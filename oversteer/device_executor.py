@@ -0,0 +1,66 @@
+import logging
+from queue import Queue
+from threading import Thread
+import time
+
+class DeviceExecutor:
+
+    # Runs the hardware commands of one device in submission order on a
+    # background thread, so mode switches, centering and attribute writes
+    # never block the GUI. The callback is called from the worker thread
+    # after every command with its label, result and the exception it
+    # raised, if any.
+
+    stop_timeout = 15
+
+    def __init__(self, name, callback = None):
+        self.name = name
+        self.callback = callback
+        self.queue = Queue()
+        self.thread = None
+        self.completed = 0
+        self.failed = 0
+
+    def start(self):
+        self.thread = Thread(target=self.run, name='DeviceExecutor ' + self.name, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        # Commands already submitted are run before the worker exits
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join(self.stop_timeout)
+        self.thread = None
+        logging.debug("DeviceExecutor %s: %d commands, %d failed", self.name, self.completed, self.failed)
+
+    def submit(self, label, function, *args):
+        if self.thread is None:
+            self.start()
+        self.queue.put((label, function, args))
+
+    def is_busy(self):
+        return self.queue.unfinished_tasks > 0
+
+    def run(self):
+        while True:
+            command = self.queue.get()
+            if command is None:
+                self.queue.task_done()
+                return
+            label, function, args = command
+            start_time = time.perf_counter()
+            result = None
+            error = None
+            try:
+                result = function(*args)
+            except Exception as e:
+                logging.exception("DeviceExecutor %s: %s failed", self.name, label)
+                error = e
+                self.failed += 1
+            self.completed += 1
+            logging.debug("DeviceExecutor %s: %s took %.1f ms", self.name, label,
+                    (time.perf_counter() - start_time) * 1000)
+            self.queue.task_done()
+            if self.callback is not None:
+                self.callback(self, label, result, error)
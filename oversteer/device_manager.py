@@ -1,56 +1,23 @@
 import logging
 import os
 import pyudev
+from threading import Condition, Thread
 import time
 from .device import Device
 from . import wheel_ids as wid
 
 class DeviceManager:
 
+    ready_timeout = 5
+
+    probe_interval = 0.02
+
     def __init__(self):
-        self.supported_wheels = {
-            wid.CM_C5: 1080,
-            wid.FT_CSL_DD: 1080,
-            wid.FT_CSL_ELITE: 1080,
-            wid.FT_CSL_ELITE_PS4: 1080,
-            wid.FT_CSV25: 900,
-            wid.FT_CSV2: 900,
-            wid.FT_PDD1: 1080,
-            wid.FT_PDD2: 1080,
-            wid.LG_DF: 270,
-            wid.LG_DFGT: 900,
-            wid.LG_DFP: 900,
-            wid.LG_G25: 900,
-            wid.LG_G27: 900,
-            wid.LG_G29: 900,
-            wid.LG_G920: 900,
-            wid.LG_G923P: 900,
-            wid.LG_G923X: 900,
-            wid.LG_GPRO: 1080,
-            wid.LG_MOMO2: 270,
-            wid.LG_MOMO: 270,
-            wid.LG_SFW: 270,
-            wid.LG_WFF: 180,
-            wid.LG_WFFG: 180,
-            wid.LG_WFG: 180,
-            wid.TM_F458: 240,
-            wid.TM_FFRW: 180,
-            wid.TM_T150: 1080,
-            wid.TM_T248: 900,
-            wid.TM_T300RS: 1080,
-            wid.TM_T300RS_FF1: 1080,
-            wid.TM_T300RS_GT: 1080,
-            wid.TM_T500RS: 1080,
-            wid.TM_T80: 240,
-            wid.TM_T80H: 240,
-            wid.TM_TMX: 900,
-            wid.TM_TSXW: 1080,
-            wid.TS_PC: 1080,
-            wid.TM_TX: 900,
-            wid.XX_FFBOARD: 1080,
-        }
+        self.supported_wheels = wid.supported_wheels
         self.devices = {}
         self.changed = True
+        self.listeners = []
+        self.ready_condition = Condition()
 
     def start(self):
         context = pyudev.Context()
@@ -69,17 +36,70 @@ class DeviceManager:
             return
         logging.debug("Udev event %s: %s", action, id)
         if action == 'add':
-            self.update_device_list(udevice)
+            # Added devices stay not ready until wait_device_ready has probed them
+            self.update_device_list(udevice, False)
             device = self.get_device(id)
             if device:
-                time.sleep(5)
-                device.enable()
-                self.changed = True
+                Thread(target=self.wait_device_ready, args=[device], daemon=True).start()
         if action == 'remove':
             device = self.get_device(id)
             if device:
                 device.disable()
                 self.changed = True
+                # Listeners may wait for devices, which needs this thread
+                # to go on handling udev events
+                Thread(target=self.notify_listeners, daemon=True).start()
+
+    def wait_device_ready(self, device):
+        deadline = time.monotonic() + self.ready_timeout
+        ready = device.check_ready()
+        while not ready and device.dev_name is not None and time.monotonic() < deadline:
+            time.sleep(self.probe_interval)
+            ready = device.check_ready()
+        if device.dev_name is None:
+            # Removed while waiting
+            return
+        if ready:
+            # check_ready left the attributes open
+            logging.debug("Device ready: %s", device.get_id())
+            device.probe_input()
+        else:
+            # Usually missing permissions, enable the device anyway so the
+            # user gets told about them
+            logging.warning("Device not ready after %d s, enabling it anyway: %s", self.ready_timeout,
+                    device.get_id())
+            device.probe()
+        with self.ready_condition:
+            device.enable()
+            self.changed = True
+            self.ready_condition.notify_all()
+        self.notify_listeners()
+
+    def wait_for_device(self, device, timeout):
+        def find_device():
+            for item in list(self.devices.values()):
+                if not item.is_ready():
+                    continue
+                if device.phys_path is not None:
+                    if item.phys_path == device.phys_path:
+                        return item
+                elif device.dev_path is not None:
+                    # The HID device is re-created under the same USB interface
+                    if item.dev_path is not None and os.path.dirname(item.dev_path) == os.path.dirname(device.dev_path):
+                        return item
+                elif item.usb_id == device.usb_id:
+                    return item
+            return None
+
+        with self.ready_condition:
+            return self.ready_condition.wait_for(find_device, timeout)
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def notify_listeners(self):
+        for callback in self.listeners:
+            callback()
 
     def init_device_list(self):
         context = pyudev.Context()
@@ -93,7 +113,7 @@ class DeviceManager:
 
         self.changed = True
 
-    def update_device_list(self, udevice):
+    def update_device_list(self, udevice, ready = True):
         id = udevice.device_path
         device_node = udevice.device_node
 
@@ -107,7 +127,7 @@ class DeviceManager:
         logging.debug("update_device_list: %s %s", id, device_node)
 
         if id not in self.devices:
-            self.devices[id] = Device(self, {})
+            self.devices[id] = Device(self, {'ready': ready})
 
         device = self.devices[id]
 
@@ -121,11 +141,17 @@ class DeviceManager:
             'usb_id': usb_id,
             'dev_name': device_node,
             'dev_path': os.path.realpath(os.path.join(udevice.sys_path, 'device', 'device')),
+            'phys_path': udevice.get('ID_PATH'),
             'name': bytes(udevice.get('ID_VENDOR_ENC') + ' ' + udevice.get('ID_MODEL_ENC'),
                           'utf-8').decode('unicode_escape'),
             'max_range': self.supported_wheels[usb_id],
+            'ready': ready,
             })
 
+        if ready:
+            # Added devices are probed once wait_device_ready finds them ready
+            device.probe()
+
     def first_device(self):
         if self.devices:
             return self.get_device(next(iter(self.devices)))
@@ -0,0 +1,108 @@
+from collections import OrderedDict
+from evdev import ecodes, ff
+import logging
+
+class EffectPool:
+
+    # Keeps one uploaded constant force effect per (direction, level) so
+    # stepping between levels only needs play/stop writes. When the device
+    # runs out of slots the least recently used effect is updated in place.
+
+    LEFT = -1
+    RIGHT = 1
+
+    def __init__(self, input_device, slots):
+        self.input_device = input_device
+        self.slots = max(slots, 1)
+        self.effects = OrderedDict()
+        self.uploads = 0
+        self.updates = 0
+        self.erases = 0
+        self.writes = 0
+
+    @staticmethod
+    def make_effect(direction, level):
+        return ff.Effect(
+            ecodes.FF_CONSTANT, -1, 0x4000 if direction == EffectPool.LEFT else 0xc000,
+            ff.Trigger(0, 0),
+            ff.Replay(0, 0),
+            ff.EffectType(ff_constant_effect=ff.Constant(level=level))
+        )
+
+    def prepare(self, keys):
+        # Upload as many of the given (direction, level) pairs as there are
+        # free slots, in order of use
+        for key in keys:
+            if len(self.effects) >= self.slots:
+                break
+            if key not in self.effects and self.upload(key, False) is None:
+                break
+
+    def upload(self, key, reuse = True):
+        effect = self.make_effect(*key)
+        try:
+            effect.id = self.input_device.upload_effect(effect)
+        except OSError as e:
+            if not self.effects:
+                raise
+            # The device has fewer free slots than it reports
+            logging.debug("EffectPool: %s, using %d slots", e, len(self.effects))
+            self.slots = len(self.effects)
+            return self.reuse(key) if reuse else None
+        self.uploads += 1
+        self.effects[key] = effect
+        return effect
+
+    def reuse(self, key):
+        # The most recently used effect may still be playing, never touch it
+        # unless it is the only one, then stop it before changing it
+        if len(self.effects) > 1:
+            _, effect = self.effects.popitem(last=False)
+        else:
+            _, effect = self.effects.popitem()
+            self.stop(effect.id)
+        direction, level = key
+        effect.direction = 0x4000 if direction == self.LEFT else 0xc000
+        effect.u.ff_constant_effect.level = level
+        self.input_device.upload_effect(effect)
+        self.updates += 1
+        self.effects[key] = effect
+        return effect
+
+    def get(self, direction, level):
+        key = (direction, level)
+        effect = self.effects.get(key)
+        if effect is not None:
+            self.effects.move_to_end(key)
+            return effect
+        if len(self.effects) < self.slots:
+            return self.upload(key)
+        return self.reuse(key)
+
+    def get_id(self, direction, level):
+        return self.get(direction, level).id
+
+    def play(self, effect_id):
+        self.input_device.write(ecodes.EV_FF, effect_id, 1)
+        self.writes += 1
+
+    def stop(self, effect_id):
+        self.input_device.write(ecodes.EV_FF, effect_id, 0)
+        self.writes += 1
+
+    def close(self):
+        for effect in self.effects.values():
+            try:
+                self.input_device.erase_effect(effect.id)
+                self.erases += 1
+            except OSError as e:
+                logging.debug("EffectPool: %s", e)
+        self.effects.clear()
+
+    def get_stats(self):
+        return {
+            'uploads': self.uploads,
+            'updates': self.updates,
+            'erases': self.erases,
+            'writes': self.writes,
+        }
@@ -0,0 +1,79 @@
+from evdev import ecodes
+import logging
+import numpy as np
+import os
+import time
+
+def monotonic_time():
+    return time.clock_gettime(time.CLOCK_MONOTONIC)
+
+class EffectScheduler:
+
+    # Plays and stops effects at absolute deadlines relative to a start time,
+    # all on CLOCK_MONOTONIC, the clock Capture uses for the wheel samples
+
+    def __init__(self, input_device):
+        self.input_device = input_device
+        self.origin = None
+        self.steps = []
+        self.timer_fd = None
+        if hasattr(os, 'timerfd_create'):
+            self.timer_fd = os.timerfd_create(time.CLOCK_MONOTONIC, flags=os.TFD_CLOEXEC)
+
+    def start(self):
+        self.origin = monotonic_time()
+        self.steps = []
+        return self.origin
+
+    def close(self):
+        if self.timer_fd is not None:
+            os.close(self.timer_fd)
+            self.timer_fd = None
+
+    def elapsed(self):
+        return monotonic_time() - self.origin
+
+    def wait_until(self, at):
+        deadline = self.origin + at
+        if self.timer_fd is not None:
+            os.timerfd_settime(self.timer_fd, flags=os.TFD_TIMER_ABSTIME, initial=deadline)
+            os.read(self.timer_fd, 8)
+            return
+        # time.sleep uses clock_nanosleep on CLOCK_MONOTONIC with an absolute deadline
+        remaining = deadline - monotonic_time()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def write(self, effect_id, value, at, label = None):
+        self.wait_until(at)
+        self.input_device.write(ecodes.EV_FF, effect_id, value)
+        written = self.elapsed()
+        self.steps.append((label, at, written))
+        return written
+
+    def play(self, effect_id, at, label = None):
+        return self.write(effect_id, 1, at, label)
+
+    def stop(self, effect_id, at, label = None):
+        return self.write(effect_id, 0, at, label)
+
+    def get_schedule_errors(self):
+        return np.array([written - at for _, at, written in self.steps])
+
+    def get_stats(self):
+        errors = self.get_schedule_errors()
+        if len(errors) == 0:
+            return None
+        return {
+            'steps': len(errors),
+            'mean_error': float(errors.mean()),
+            'max_error': float(errors.max()),
+        }
+
+    def log_stats(self):
+        for label, at, written in self.steps:
+            logging.debug("EffectScheduler: %s at %.4f s, error %.3f ms", label, at, (written - at) * 1000)
+        stats = self.get_stats()
+        if stats is not None:
+            logging.debug("EffectScheduler: %d steps, mean error %.3f ms, max error %.3f ms",
+                    stats['steps'], stats['mean_error'] * 1000, stats['max_error'] * 1000)
@@ -1,6 +1,5 @@
 import gi
 from locale import gettext as _
-import threading
 import traceback
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk, Gdk
@@ -27,14 +26,14 @@ class GtkHandlers:
         return True
 
     def on_preferences_clicked(self, *args):
-        self.ui.preferences_window.show()
+        self.ui.load_preferences_window().show()
 
     def on_cancel_preferences_clicked(self, *args):
         self.controller.on_close_preferences()
         self.ui.preferences_window.hide()
 
     def on_about_clicked(self, *args):
-        self.ui.about_window.show()
+        self.ui.load_about_window().show()
 
     def on_about_window_response(self, *args):
         self.ui.about_window.hide()
@@ -43,6 +42,10 @@ class GtkHandlers:
         self.ui.about_window.hide()
         return True
 
+    def on_main_notebook_switch_page(self, notebook, page, page_num):
+        if page == self.ui.test_page:
+            self.ui.load_test_page()
+
     def on_device_changed(self, widget):
         device_id = widget.get_active_id()
         if device_id is not None:
@@ -64,21 +67,21 @@ class GtkHandlers:
     def on_wheel_range_value_changed(self, widget):
         wrange = int(widget.get_value() * 10)
         self.model.set_range(wrange)
-        self.ui.overlay_wheel_range.set_label(str(wrange))
+        self.ui.set_overlay_range(wrange)
 
     def on_overlay_decrange_clicked(self, widget):
         adjustment = self.ui.wheel_range.get_adjustment()
         step = adjustment.get_step_increment()
         self.ui.wheel_range.set_value(self.ui.wheel_range.get_value() - step)
         wrange = int(self.ui.wheel_range.get_value() * 10)
-        self.ui.overlay_wheel_range.set_label(str(wrange))
+        self.ui.set_overlay_range(wrange)
 
     def on_overlay_incrange_clicked(self, widget):
         adjustment = self.ui.wheel_range.get_adjustment()
         step = adjustment.get_step_increment()
         self.ui.wheel_range.set_value(self.ui.wheel_range.get_value() + step)
         wrange = int(self.ui.wheel_range.get_value() * 10)
-        self.ui.overlay_wheel_range.set_label(str(wrange))
+        self.ui.set_overlay_range(wrange)
 
     def on_combine_none_clicked(self, widget):
         self.model.set_combine_pedals(0)
@@ -118,10 +121,6 @@ class GtkHandlers:
     def on_ffbmeter_overlay_clicked(self, widget):
         state = widget.get_active()
         self.model.set_ffb_overlay(state)
-        if state:
-            self.ui._ffbmeter_overlay.show()
-        else:
-            self.ui._ffbmeter_overlay.hide()
         self.ui.update_overlay()
 
     def on_wheel_range_overlay_clicked(self, widget):
@@ -135,7 +134,7 @@ class GtkHandlers:
         self.model.set_use_buttons(state)
 
     def on_center_wheel_state_set(self, widget, state):
-        threading.Thread(target = self.model.set_center_wheel, args = [state], daemon = True).start()
+        self.model.set_center_wheel(state)
 
     def on_profile_changed(self, combobox):
         self.controller.load_profile(combobox.get_active_id())
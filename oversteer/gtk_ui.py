@@ -4,6 +4,8 @@ from locale import gettext as _
 import logging
 import math
 import os
+from threading import Lock
+import time
 from .gtk_handlers import GtkHandlers
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk, Gdk, GLib
@@ -16,6 +18,25 @@ class GtkUi:
         self.ffbmeter_timer = False
         self.current_test_canvas = None
         self.current_test_toolbar = None
+        self.pending_inputs = {}
+        self.deferred_inputs = {}
+        self.flushed_inputs = {}
+        self.flush_scheduled = False
+        self.pending_inputs_lock = Lock()
+        self.coalesced_updates = 0
+        self.handlers = None
+        self.loaded_ui_files = set()
+        self.about_window = None
+        self.preferences_window = None
+        self.overlay_window = None
+        self.test_chart_window = None
+        self.test_container = None
+        self.app_version = None
+        self.languages = None
+        self.language = None
+        self.check_permissions_state = None
+        self.controls_enabled = True
+        self.overlay_range_text = None
 
         Gdk.init(argv)
         style_provider = Gtk.CssProvider()
@@ -28,7 +49,7 @@ class GtkUi:
 
         self.builder = Gtk.Builder()
         self.builder.set_translation_domain('oversteer')
-        self.builder.add_from_file(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'main.ui'))
+        self.builder.add_from_file(self.ui_file('main.ui'))
 
         self._set_builder_objects()
 
@@ -55,11 +76,12 @@ class GtkUi:
     def reset_view(self):
         self.new_profile_name_entry.hide()
         self.start_app.hide()
-        self.switch_test_panel(None)
+        if self.test_container is not None:
+            self.switch_test_panel(None)
 
     def start(self):
-        handlers = GtkHandlers(self, self.controller)
-        self.builder.connect_signals(handlers)
+        self.handlers = GtkHandlers(self, self.controller)
+        self.builder.connect_signals(self.handlers)
         self.window.show_all()
         self.reset_view()
         self._set_range_markers(1080)
@@ -67,12 +89,85 @@ class GtkUi:
     def main(self):
         Gtk.main()
 
+    @staticmethod
+    def ui_file(filename):
+        return os.path.join(os.path.dirname(os.path.realpath(__file__)), filename)
+
+    def load_ui_file(self, filename, set_objects):
+        # Secondary windows and the tests page are kept in their own files
+        # and only built the first time they're needed. Signals are
+        # connected after set_objects so restoring state doesn't fire them.
+        if filename in self.loaded_ui_files:
+            return
+        start_time = time.perf_counter()
+        self.builder.add_from_file(self.ui_file(filename))
+        self.loaded_ui_files.add(filename)
+        set_objects()
+        if self.handlers is not None:
+            self.builder.connect_signals(self.handlers)
+        logging.debug("Loaded %s in %.1f ms", filename, (time.perf_counter() - start_time) * 1000)
+
+    def load_about_window(self):
+        self.load_ui_file('about.ui', self._set_about_objects)
+        return self.about_window
+
+    def load_preferences_window(self):
+        self.load_ui_file('preferences.ui', self._set_preferences_objects)
+        return self.preferences_window
+
+    def load_overlay_window(self):
+        self.load_ui_file('overlay.ui', self._set_overlay_objects)
+        return self.overlay_window
+
+    def load_test_chart_window(self):
+        self.load_ui_file('test_chart.ui', self._set_test_chart_objects)
+        return self.test_chart_window
+
+    def load_test_page(self):
+        self.load_ui_file('test.ui', self._set_test_objects)
+        return self.test_container
+
+    def on_first_frame(self, callback):
+        def on_draw(widget, context):
+            widget.disconnect(handler_id)
+            GLib.idle_add(callback)
+            return False
+        handler_id = self.window.connect('draw', on_draw)
+
     def quit(self):
+        logging.debug("Coalesced input updates: %d", self.coalesced_updates)
         Gtk.main_quit()
 
     def safe_call(self, callback, *args):
         GLib.idle_add(callback, *args)
 
+    def queue_input(self, key, callback, *args, delay = 0):
+        # Only the latest value for each input reaches the widgets, once per frame
+        not_before = time.monotonic() + delay if delay else 0
+        with self.pending_inputs_lock:
+            previous = self.pending_inputs.get(key)
+            if previous is None and key not in self.deferred_inputs and self.flushed_inputs.get(key) == args:
+                # Already shown
+                self.coalesced_updates += 1
+                return
+            if previous is not None and delay and not previous[2]:
+                # Let the pending value be shown before the delayed one
+                self.deferred_inputs[key] = (callback, args, not_before)
+            else:
+                if previous is not None:
+                    self.coalesced_updates += 1
+                self.deferred_inputs.pop(key, None)
+                self.pending_inputs[key] = (callback, args, not_before)
+            if self.flush_scheduled:
+                return
+            self.flush_scheduled = True
+        # Tick callbacks can only be added from the main thread
+        GLib.idle_add(self._add_flush_tick)
+
+    def _add_flush_tick(self):
+        self.window.add_tick_callback(self._flush_inputs)
+        return False
+
     def confirmation_dialog(self, message):
         dialog = Gtk.MessageDialog(self.window, 0,
                 Gtk.MessageType.WARNING, Gtk.ButtonsType.OK_CANCEL, message)
@@ -115,6 +210,11 @@ class GtkUi:
         if file_type == 'csv':
             file_filter.set_name('CSV')
             file_filter.add_pattern('*.csv')
+        elif file_type == 'test':
+            file_filter.set_name(_('Test data'))
+            file_filter.add_pattern('*.csv')
+            file_filter.add_pattern('*.ovcap')
+            file_filter.add_pattern('*.ovcapz')
         elif file_type == 'ini':
             file_filter.set_name('INI')
             file_filter.add_pattern('*.ini')
@@ -140,7 +240,9 @@ class GtkUi:
         self.window.queue_draw()
 
     def set_app_version(self, version):
-        self.about_window.set_version(version)
+        self.app_version = version
+        if self.about_window is not None:
+            self.about_window.set_version(version)
 
     def set_app_icon(self, icon):
         if not os.access(icon, os.R_OK):
@@ -149,6 +251,9 @@ class GtkUi:
         self.window.set_icon_from_file(icon)
 
     def set_languages(self, languages):
+        self.languages = languages
+        if self.preferences_window is None:
+            return
         cell_renderer = Gtk.CellRendererText()
         self.languages_combobox.pack_start(cell_renderer, True)
         self.languages_combobox.add_attribute(cell_renderer, 'text', 1)
@@ -160,10 +265,14 @@ class GtkUi:
         self.languages_combobox.set_model(model)
 
     def set_language(self, language):
-        self.languages_combobox.set_active_id(language)
+        self.language = language
+        if self.preferences_window is not None:
+            self.languages_combobox.set_active_id(language)
 
     def set_check_permissions(self, state):
-        self.check_permissions.set_state(state)
+        self.check_permissions_state = state
+        if self.preferences_window is not None:
+            self.check_permissions.set_state(state)
 
     def set_device_id(self, device_id):
         self.device_combobox.set_active_id(device_id)
@@ -186,14 +295,16 @@ class GtkUi:
             self.disable_controls()
 
     def disable_controls(self):
+        self.controls_enabled = False
         self.profile_combobox.set_sensitive(False)
-        self.test_start_button.set_sensitive(False)
-        self.test_start_button.set_sensitive(False)
+        if self.test_container is not None:
+            self.test_start_button.set_sensitive(False)
 
     def enable_controls(self):
+        self.controls_enabled = True
         self.profile_combobox.set_sensitive(True)
-        self.test_start_button.set_sensitive(True)
-        self.test_start_button.set_sensitive(True)
+        if self.test_container is not None:
+            self.test_start_button.set_sensitive(True)
 
     def update_profiles_combobox(self):
         model = self.profile_combobox.get_model()
@@ -275,8 +386,12 @@ class GtkUi:
         self.wheel_range_overlay_auto.set_sensitive(True)
         wrange = int(wrange) / 10
         self.wheel_range.set_value(wrange)
-        wrange = str(round(wrange * 10))
-        self.overlay_wheel_range.set_label(wrange)
+        self.set_overlay_range(round(wrange * 10))
+
+    def set_overlay_range(self, wrange):
+        self.overlay_range_text = str(wrange)
+        if self.overlay_window is not None:
+            self.overlay_wheel_range.set_label(self.overlay_range_text)
 
     def set_combine_pedals(self, combine_pedals):
         if combine_pedals is None:
@@ -401,12 +516,8 @@ class GtkUi:
             self.hat_up_input.set_value(0)
             self.hat_down_input.set_value(value)
 
-    def set_btn_input(self, index, value, wait = None):
-        if wait is not None:
-            GLib.timeout_add(wait, lambda index=index, value=value: self.set_btn_input(index, value))
-        else:
-            self.btn_input[index].set_value(value)
-        return False
+    def set_btn_input(self, index, value):
+        self.btn_input[index].set_value(value)
 
     def set_ffbmeter_overlay_visibility(self, state):
         self.ffbmeter_overlay.set_sensitive(state)
@@ -415,7 +526,8 @@ class GtkUi:
         self.start_define_buttons.set_label(text)
 
     def reset_define_buttons_text(self):
-        self.start_define_buttons.set_label(self.define_buttons_text)
+        if self.preferences_window is not None:
+            self.start_define_buttons.set_label(self.define_buttons_text)
 
     def get_wheel_range_overlay(self):
         wheel_range_overlay = None
@@ -431,6 +543,7 @@ class GtkUi:
         ffbmeter_overlay = self.ffbmeter_overlay.get_active()
         wheel_range_overlay = self.get_wheel_range_overlay()
         if ffbmeter_overlay or wheel_range_overlay == 'always' or (wheel_range_overlay == 'auto' and auto):
+            self.load_overlay_window()
             if not self.overlay_window.props.visible:
                 self.overlay_window.show()
             if not self.ffbmeter_timer and self.overlay_window.props.visible and ffbmeter_overlay:
@@ -444,7 +557,7 @@ class GtkUi:
                 self._wheel_range_overlay.show()
             else:
                 self._wheel_range_overlay.hide()
-        else:
+        elif self.overlay_window is not None:
             self.overlay_window.hide()
 
     def enable_save_profile(self):
@@ -464,6 +577,7 @@ class GtkUi:
         self.start_app_manually.set_state(state)
 
     def on_test_ready(self):
+        self.load_test_page()
         if self.device_combobox.get_active_id() is not None:
             self.test_start_button.set_sensitive(True)
         self.test_open_chart_button.set_sensitive(True)
@@ -471,12 +585,15 @@ class GtkUi:
         self.test_container_stack.set_visible_child(self.test_panel_results)
 
     def switch_test_panel(self, test_id):
+        self.load_test_page()
         self.test_panel_warning.set_visible(False)
+        self.test_analysis_progress.set_visible(False)
         self.test_panel_buttons.set_visible(False)
         self.test_start_button.set_sensitive(False)
         self.test_open_chart_button.set_sensitive(False)
         self.test_export_csv_button.set_sensitive(False)
-        self.test_chart_window.hide()
+        if self.test_chart_window is not None:
+            self.test_chart_window.hide()
         if test_id is None:
             self.test_container_stack.set_visible_child(self.test_panel_empty)
             self.test_start_button.set_sensitive(True)
@@ -495,9 +612,20 @@ class GtkUi:
             self.test_panel_buttons.set_visible(True)
             self.test_panel_warning.set_visible(True)
 
+    def show_test_analysis(self, fraction, text):
+        self.load_test_page()
+        self.test_panel_warning.set_visible(False)
+        self.test_panel_buttons.set_visible(False)
+        self.test_analysis_progress.set_fraction(fraction)
+        self.test_analysis_progress.set_text(text)
+        self.test_analysis_progress.set_visible(True)
+        self.test_container_stack.set_visible_child(self.test_panel_running)
+
     def show_test_running(self, test_id, data = None):
+        self.load_test_page()
         self.test_panel_warning.set_visible(False)
         self.test_panel_buttons.set_visible(False)
+        self.test_analysis_progress.set_visible(False)
         if test_id == 0:
             self.test_panel_running1_ready.set_visible(True)
             self.test_panel_running1_go.set_visible(False)
@@ -543,11 +671,37 @@ class GtkUi:
         self.overlay_led_4.set_value((led_states >> 4) & 1)
         return True
 
+    def _flush_inputs(self, widget, frame_clock):
+        # Runs once per frame while there are pending inputs, values equal to
+        # the last ones shown are dropped
+        now = time.monotonic()
+        with self.pending_inputs_lock:
+            pending = self.pending_inputs
+            self.pending_inputs = {}
+            for key, entry in list(pending.items()):
+                if entry[2] > now:
+                    self.pending_inputs[key] = pending.pop(key)
+                elif self.flushed_inputs.get(key) == entry[1]:
+                    del pending[key]
+                    self.coalesced_updates += 1
+                else:
+                    self.flushed_inputs[key] = entry[1]
+            self.pending_inputs.update(self.deferred_inputs)
+            self.deferred_inputs = {}
+            if not self.pending_inputs:
+                self.flush_scheduled = False
+            keep_ticking = self.flush_scheduled
+        for callback, args, not_before in pending.values():
+            callback(*args)
+        return keep_ticking
+
     def _round_input(self, value, decimals = 0):
         multiplier = 10 ** decimals
         return math.floor(value * multiplier) / multiplier
 
     def show_test_chart(self, canvas, toolbar):
+        self.load_test_page()
+        self.load_test_chart_window()
         if self.current_test_canvas is not None:
             self.test_chart_frame.remove(self.current_test_canvas)
         if self.current_test_toolbar is not None:
@@ -567,16 +721,6 @@ class GtkUi:
 
     def _set_builder_objects(self):
         self.window = self.builder.get_object('main_window')
-        self.about_window = self.builder.get_object('about_window')
-        self.preferences_window = self.builder.get_object('preferences_window')
-        self.overlay_window = self.builder.get_object('overlay_window')
-        self.overlay_window.set_keep_above(True)
-        self.overlay_window.connect("screen-changed", self._screen_changed)
-        self._screen_changed(self.overlay_window, None)
-
-        self.languages_combobox = self.builder.get_object('languages')
-        self.check_permissions = self.builder.get_object('check_permissions')
-
         self.device_combobox = self.builder.get_object('device')
         self.profile_combobox = self.builder.get_object('profile')
         self.new_profile_name_entry = self.builder.get_object('new_profile_name')
@@ -599,18 +743,8 @@ class GtkUi:
         self.wheel_range_overlay_never = self.builder.get_object('wheel_range_overlay_never')
         self.wheel_range_overlay_always = self.builder.get_object('wheel_range_overlay_always')
         self.wheel_range_overlay_auto = self.builder.get_object('wheel_range_overlay_auto')
-        self._ffbmeter_overlay = self.builder.get_object('_ffbmeter_overlay')
-        self._wheel_range_overlay = self.builder.get_object('_wheel_range_overlay')
-        self.overlay_wheel_range = self.builder.get_object('overlay_wheel_range')
-        self.overlay_led_0 = self.builder.get_object('overlay_led_0')
-        self.overlay_led_1 = self.builder.get_object('overlay_led_1')
-        self.overlay_led_2 = self.builder.get_object('overlay_led_2')
-        self.overlay_led_3 = self.builder.get_object('overlay_led_3')
-        self.overlay_led_4 = self.builder.get_object('overlay_led_4')
         self.wheel_buttons = self.builder.get_object('wheel_buttons')
         self.center_wheel = self.builder.get_object('center_wheel')
-        self.start_define_buttons = self.builder.get_object('start_define_buttons')
-        self.define_buttons_text = self.start_define_buttons.get_label()
         self.start_app = self.builder.get_object('start_app')
         self.start_app_manually = self.builder.get_object('start_app_manually')
 
@@ -628,6 +762,7 @@ class GtkUi:
             self.btn_input[i] = self.builder.get_object('btn' + str(i) + '_input')
 
         self.profile_listbox = self.builder.get_object('profile_listbox')
+        self.test_page = self.builder.get_object('test_page')
 
         def sort_profiles(row1, row2):
             text1 = row1.get_children()[0].get_text().lower()
@@ -640,11 +775,48 @@ class GtkUi:
 
         self.profile_listbox.set_sort_func(sort_profiles)
 
-        self.test_container = self.builder.get_object('test_container')
-        self.test_container_stack = self.builder.get_object('test_container_stack')
+    def _set_about_objects(self):
+        self.about_window = self.builder.get_object('about_window')
+        if self.app_version is not None:
+            self.about_window.set_version(self.app_version)
+
+    def _set_preferences_objects(self):
+        self.preferences_window = self.builder.get_object('preferences_window')
+        self.languages_combobox = self.builder.get_object('languages')
+        self.check_permissions = self.builder.get_object('check_permissions')
+        self.start_define_buttons = self.builder.get_object('start_define_buttons')
+        self.define_buttons_text = self.start_define_buttons.get_label()
+        if self.languages is not None:
+            self.set_languages(self.languages)
+        if self.language is not None:
+            self.set_language(self.language)
+        if self.check_permissions_state is not None:
+            self.set_check_permissions(self.check_permissions_state)
+
+    def _set_overlay_objects(self):
+        self.overlay_window = self.builder.get_object('overlay_window')
+        self.overlay_window.set_keep_above(True)
+        self.overlay_window.connect("screen-changed", self._screen_changed)
+        self._screen_changed(self.overlay_window, None)
+        self._ffbmeter_overlay = self.builder.get_object('_ffbmeter_overlay')
+        self._wheel_range_overlay = self.builder.get_object('_wheel_range_overlay')
+        self.overlay_wheel_range = self.builder.get_object('overlay_wheel_range')
+        self.overlay_led_0 = self.builder.get_object('overlay_led_0')
+        self.overlay_led_1 = self.builder.get_object('overlay_led_1')
+        self.overlay_led_2 = self.builder.get_object('overlay_led_2')
+        self.overlay_led_3 = self.builder.get_object('overlay_led_3')
+        self.overlay_led_4 = self.builder.get_object('overlay_led_4')
+        if self.overlay_range_text is not None:
+            self.overlay_wheel_range.set_label(self.overlay_range_text)
+
+    def _set_test_chart_objects(self):
         self.test_chart_window = self.builder.get_object('test_chart_window')
         self.test_chart_container = self.builder.get_object('test_chart_container')
         self.test_chart_frame = self.builder.get_object('test_chart_frame')
+
+    def _set_test_objects(self):
+        self.test_container = self.builder.get_object('test_container')
+        self.test_container_stack = self.builder.get_object('test_container_stack')
         self.test_start_button = self.builder.get_object('test_start_button')
         self.test_open_chart_button = self.builder.get_object('test_open_chart_button')
         self.test_export_csv_button = self.builder.get_object('test_export_csv_button')
@@ -667,6 +839,7 @@ class GtkUi:
         self.test_panel_start2 = self.builder.get_object('test_panel_start2')
         self.test_panel_start3 = self.builder.get_object('test_panel_start3')
         self.test_panel_running = self.builder.get_object('test_panel_running')
+        self.test_analysis_progress = self.builder.get_object('test_analysis_progress')
         self.test_panel_running1 = self.builder.get_object('test_panel_running1')
         self.test_panel_running1_ready = self.builder.get_object('test_panel_running1_ready')
         self.test_panel_running1_go = self.builder.get_object('test_panel_running1_go')
@@ -676,6 +849,12 @@ class GtkUi:
         self.test_panel_back = self.builder.get_object('test_panel_back')
         self.test_panel_run = self.builder.get_object('test_panel_run')
 
+        self.test_page.pack_start(self.test_container, True, True, 0)
+        self.test_container.show_all()
+        self.switch_test_panel(None)
+        if not self.controls_enabled:
+            self.test_start_button.set_sensitive(False)
+
     def _set_markers(self):
         self.autocenter.add_mark(20, Gtk.PositionType.BOTTOM, '20')
         self.autocenter.add_mark(40, Gtk.PositionType.BOTTOM, '40')
@@ -1,5 +1,4 @@
 import configparser
-import csv
 from datetime import datetime
 from evdev import ecodes
 import glob
@@ -12,14 +11,11 @@ import signal
 import subprocess
 import sys
 from threading import Thread
-import time
 from xdg.BaseDirectory import save_config_path
+from .device_executor import DeviceExecutor
 from .gtk_ui import GtkUi
+from .input_reactor import InputReactor
 from .model import Model
-from .test import Test
-from .combined_chart import CombinedChart
-from .linear_chart import LinearChart
-from .performance_chart import PerformanceChart
 
 class Gui:
 
@@ -61,11 +57,17 @@ class Gui:
         self.linear_chart = None
         self.performance_chart = None
         self.combined_chart = None
+        self.analysis_worker = None
+        self.test_data = None
+        self.minimum_level = 0
+        self.minimum_level_interval = None
         self.button_setup_step = False
         self.button_config = [-1] * 9
         self.button_config[0] = [-1]
         self.pressed_button_count = 0
 
+        self.input_reactor = InputReactor(self.device_manager, self.on_input_events)
+
         signal.signal(signal.SIGINT, self.sig_int_handler)
 
         self.config_path = save_config_path('oversteer')
@@ -75,7 +77,10 @@ class Gui:
         if not os.path.isdir(self.app.profile_path):
             os.makedirs(self.app.profile_path, 0o700)
 
+        startup_timer = self.app.startup_timer
         self.ui = GtkUi(self, argv)
+        startup_timer.mark('UI build')
+        self.device_manager.add_listener(self.on_devices_changed)
         self.ui.set_app_version(self.app.version)
         self.ui.set_app_icon(os.path.join(self.app.icondir, 'io.github.berarma.Oversteer.svg'))
         self.ui.set_languages(self.languages)
@@ -84,12 +89,15 @@ class Gui:
         self.ui.set_check_permissions(self.check_permissions)
 
         self.models = {}
+        self.executors = {}
 
         self.ui.start()
 
         self.model.set_ui(self.ui)
 
         self.populate_window()
+        startup_timer.mark('window setup')
+        self.ui.on_first_frame(self.on_first_frame)
 
         if self.app.args.profile is not None:
             self.ui.set_profile(self.app.args.profile)
@@ -108,10 +116,15 @@ class Gui:
             else:
                 self.start_app()
 
-        Thread(target=self.input_thread, daemon = True).start()
+        Thread(target=self.input_reactor.run, daemon = True).start()
 
         self.ui.main()
 
+        for model in self.models.values():
+            model.flush_writes()
+        for executor in self.executors.values():
+            executor.stop()
+
     def start_app(self):
         self.ui.disable_start_app()
         Thread(target=self.run_command).start() 
@@ -187,9 +200,14 @@ class Gui:
         else:
             self.model = Model(self.device, self.ui)
             self.models[self.device.get_id()] = self.model
+        self.model.set_executor(self.get_executor(self.device))
 
+        capabilities = self.device.get_capabilities()
         self.ui.set_max_range(self.device.get_max_range())
-        self.ui.set_modes(self.model.get_mode_list())
+        if capabilities.has_attribute('alternate_modes'):
+            self.ui.set_modes(self.model.get_mode_list())
+        else:
+            self.ui.set_modes(None)
 
         if self.model.get_profile():
             self.ui.set_profile(self.model.get_profile())
@@ -197,6 +215,21 @@ class Gui:
             self.model.flush_device()
             self.model.flush_ui()
 
+        self.input_reactor.wakeup()
+
+    def get_executor(self, device):
+        device_id = device.get_id()
+        if device_id not in self.executors:
+            self.executors[device_id] = DeviceExecutor(device_id, self.on_device_command_done)
+        return self.executors[device_id]
+
+    def on_device_command_done(self, executor, label, result, error):
+        if error is not None:
+            self.ui.safe_call(self.ui.error_dialog, _('Error changing wheel settings'), str(error))
+        elif label == 'mode' and result is False:
+            self.ui.safe_call(self.ui.error_dialog, _('Error changing wheel settings'),
+                    _("The wheel didn't reconnect after changing the mode."))
+
     def load_profile(self, profile_name):
         if profile_name is None or profile_name == '':
             return
@@ -367,13 +400,12 @@ class Gui:
                 if value == 1:
                     self.pressed_button_count += 1
                     if self.pressed_button_count == len(self.button_config[0]):
-                        device = self.device.get_input_device()
                         if self.grab_input:
-                            device.ungrab()
+                            self.device.ungrab()
                             self.grab_input = False
                             self.ui.safe_call(self.ui.update_overlay, False)
                         else:
-                            device.grab()
+                            self.device.grab()
                             self.grab_input = True
                             self.ui.safe_call(self.ui.update_overlay, True)
                 else:
@@ -399,65 +431,58 @@ class Gui:
         return level
 
     def process_events(self, events):
-        for event in events:
-            if event.type == ecodes.EV_ABS:
-                if event.code == ecodes.ABS_X:
-                    self.last_wheel_axis_value = event.value
-                    if self.test and self.test.is_collecting_data():
-                        self.test.append_data(event.timestamp(), event.value)
-                    else:
-                        self.ui.safe_call(self.ui.set_steering_input, event.value)
-                elif event.code == ecodes.ABS_Z:
-                    self.ui.safe_call(self.ui.set_accelerator_input, event.value)
-                elif event.code == ecodes.ABS_RZ:
-                    self.ui.safe_call(self.ui.set_brakes_input, event.value)
-                elif event.code == ecodes.ABS_Y:
-                    self.ui.safe_call(self.ui.set_clutch_input, event.value)
-                elif event.code == ecodes.ABS_HAT0X:
-                    self.ui.safe_call(self.ui.set_hatx_input, event.value)
-                    if event.value == -1:
+        for etype, code, value in zip(events['type'].tolist(), events['code'].tolist(),
+                events['value'].tolist()):
+            if etype == ecodes.EV_ABS:
+                if code == ecodes.ABS_X:
+                    # The test capture reads its own copy of the position events
+                    if not (self.test and self.test.is_collecting_data()):
+                        self.ui.queue_input('steering', self.ui.set_steering_input, value)
+                elif code == ecodes.ABS_Z:
+                    self.ui.queue_input('accelerator', self.ui.set_accelerator_input, value)
+                elif code == ecodes.ABS_RZ:
+                    self.ui.queue_input('brakes', self.ui.set_brakes_input, value)
+                elif code == ecodes.ABS_Y:
+                    self.ui.queue_input('clutch', self.ui.set_clutch_input, value)
+                elif code == ecodes.ABS_HAT0X:
+                    self.ui.queue_input('hatx', self.ui.set_hatx_input, value)
+                    if value == -1:
                         self.on_button_press(100, 1)
-                    elif event.value == 1:
+                    elif value == 1:
                         self.on_button_press(101, 1)
-                elif event.code == ecodes.ABS_HAT0Y:
-                    self.ui.safe_call(self.ui.set_haty_input, event.value)
-                    if event.value == -1:
+                elif code == ecodes.ABS_HAT0Y:
+                    self.ui.queue_input('haty', self.ui.set_haty_input, value)
+                    if value == -1:
                         self.on_button_press(102, 1)
-                    elif event.value == 1:
+                    elif value == 1:
                         self.on_button_press(103, 1)
-            if event.type == ecodes.EV_KEY:
-                if event.value:
+            if etype == ecodes.EV_KEY:
+                if value:
                     delay = 0
                     if self.test and self.test.is_awaiting_action():
                         self.test.trigger_action()
                 else:
-                    delay = 100
+                    # Keep short presses visible for a moment
+                    delay = 0.1
 
                 button = None
 
-                if event.code >= 288 and event.code <= 303:
-                    button = event.code - 288
-                if event.code >= 704 and event.code <= 715:
-                    button = event.code - 688
+                if code >= 288 and code <= 303:
+                    button = code - 288
+                if code >= 704 and code <= 715:
+                    button = code - 688
 
                 if button is not None:
-                    self.ui.safe_call(self.ui.set_btn_input, button, event.value, delay)
-                    self.on_button_press(button, event.value)
-
-    def input_thread(self):
-        while 1:
-            if self.device is not None and self.device.is_ready():
-                try:
-                    events = self.device.read_events(0.5)
-                    if events is not None:
-                        self.process_events(events)
-                except OSError as e:
-                    logging.debug(e)
-                    time.sleep(1)
-            else:
-                time.sleep(1)
-            if self.device_manager.is_changed():
-                self.ui.safe_call(self.populate_devices)
+                    self.ui.queue_input(('btn', button), self.ui.set_btn_input, button, value, delay=delay)
+                    self.on_button_press(button, value)
+
+    def on_input_events(self, device_id, events):
+        if self.device is not None and device_id == self.device.get_id():
+            self.process_events(events)
+
+    def on_devices_changed(self):
+        self.input_reactor.wakeup()
+        self.ui.safe_call(self.populate_devices)
 
     def run_command(self):
         proc = subprocess.Popen(self.app.args.command, shell=True)
@@ -468,30 +493,82 @@ class Gui:
         else:
             self.ui.safe_call(self.ui.quit)
 
+    def on_first_frame(self):
+        self.app.startup_timer.mark('first frame')
+        self.app.startup_timer.report()
+
     def start_test(self):
         def test_callback(name = 'end'):
             if name == 'end':
                 self.ui.safe_call(self.end_test)
             elif name == 'running':
                 self.ui.safe_call(self.ui.show_test_running, self.test_run, 1)
+        # Analysis modules pull in numpy/scipy, only load them when needed
+        from .test import Test
+        from .test_data import TestData
+        self.cancel_analysis()
+        if self.test is not None:
+            self.test.cancel()
         self.test = Test(self.device, test_callback)
+        self.test_data = TestData(device_id=self.device.get_id(), wheel_range=self.device.get_max_range(),
+                metadata={'created': datetime.now().isoformat(timespec='seconds')})
         self.test_run = 0
         self.ui.switch_test_panel(self.test_run)
 
     def end_test(self):
         if self.test_run == 0:
             self.minimum_level = self.test.get_minimum_level()
-        elif self.test_run == 1:
-            self.linear_chart = LinearChart(self.test.get_input_values(), self.test.get_output_values(),
-                    self.device.get_max_range())
-            self.linear_chart.set_minimum_level(self.minimum_level)
-        elif self.test_run == 2:
-            self.performance_chart = PerformanceChart(self.test.get_input_values(), self.test.get_output_values(),
-                    self.device.get_max_range())
-            if self.performance_chart.get_latency() is None:
+            self.minimum_level_interval = self.test.get_minimum_level_interval()
+            self.test_data.minimum_level = self.minimum_level
+            self.test_data.minimum_level_interval = self.minimum_level_interval
+            self.next_test()
+            return
+
+        prefix = 'linear' if self.test_run == 1 else 'performance'
+        self.test_data.set_array(prefix + '_input', self.test.get_input_values())
+        self.test_data.set_array(prefix + '_output', self.test.get_output_values())
+
+        from .analysis_worker import AnalysisWorker
+        self.cancel_analysis()
+        self.analysis_worker = AnalysisWorker(self.test_run, self.test.get_input_values(),
+                self.test.get_output_values(), self.device.get_max_range(), self.minimum_level,
+                self.minimum_level_interval, self.on_analysis_done, self.on_analysis_progress)
+        self.ui.show_test_analysis(0, '')
+        self.analysis_worker.start()
+
+    def cancel_analysis(self):
+        if self.analysis_worker is not None:
+            self.analysis_worker.cancel()
+            self.analysis_worker = None
+
+    def on_analysis_progress(self, worker, fraction, text):
+        def update():
+            if worker is self.analysis_worker:
+                self.ui.show_test_analysis(fraction, text)
+        self.ui.safe_call(update)
+
+    def on_analysis_done(self, worker, results):
+        self.ui.safe_call(self.apply_analysis_results, worker, results)
+
+    def apply_analysis_results(self, worker, results):
+        if worker is not self.analysis_worker or worker.is_cancelled():
+            return
+        self.analysis_worker = None
+        if isinstance(results, Exception):
+            self.ui.error_dialog(_('Test analysis failed.'), str(results))
+            self.ui.switch_test_panel(None)
+            return
+        if results.test_run == 1:
+            self.linear_chart = results.linear_chart
+        elif results.test_run == 2:
+            if results.metrics.latency is None:
                 self.ui.error_dialog(_('Steering wheel not responding.'), _('No wheel movement could be registered.'))
                 self.ui.switch_test_panel(None)
                 return
+            from .combined_chart import CombinedChart
+            self.performance_chart = results.performance_chart
+            self.test_data.metadata['metrics'] = {name: None if value is None else float(value)
+                    for name, value in results.metrics.items()}
             self.combined_chart = CombinedChart(self.linear_chart, self.performance_chart)
             self.test = None
             self.test_run = None
@@ -518,78 +595,98 @@ class Gui:
             return
 
     def show_test_results(self):
-        self.ui.test_latency.set_text(format(1000 * self.performance_chart.get_latency(), '.0f'))
-        self.ui.test_max_velocity.set_text(format(self.performance_chart.get_max_velocity(), '.0f'))
-        self.ui.test_max_accel.set_text(format(self.performance_chart.get_max_accel(), '.0f'))
-        self.ui.test_max_decel.set_text(format(self.performance_chart.get_max_decel(), '.0f'))
-        self.ui.test_time_to_max_accel.set_text(format(1000 * self.performance_chart.get_time_to_max_accel(), '.0f'))
-        self.ui.test_time_to_max_decel.set_text(format(1000 * self.performance_chart.get_time_to_max_decel(), '.0f'))
-        self.ui.test_mean_accel.set_text(format(self.performance_chart.get_mean_accel(), '.0f'))
-        self.ui.test_mean_decel.set_text(format(self.performance_chart.get_mean_decel(), '.0f'))
-        self.ui.test_residual_decel.set_text(format(self.performance_chart.get_residual_decel(), '.0f'))
-        self.ui.test_estimated_snr.set_text(format(self.performance_chart.get_estimated_snr(), '.0f'))
-        self.ui.test_minimum_level.set_text(format(self.linear_chart.get_minimum_level_percent(), '.1f'))
+        self.ui.load_test_page()
+        metrics = self.performance_chart.get_metrics()
+        self.ui.test_latency.set_text(format(1000 * metrics.latency, '.0f'))
+        self.ui.test_max_velocity.set_text(format(metrics.max_velocity, '.0f'))
+        self.ui.test_max_accel.set_text(format(metrics.max_accel, '.0f'))
+        self.ui.test_max_decel.set_text(format(metrics.max_decel, '.0f'))
+        self.ui.test_time_to_max_accel.set_text(format(1000 * metrics.time_to_max_accel, '.0f'))
+        self.ui.test_time_to_max_decel.set_text(format(1000 * metrics.time_to_max_decel, '.0f'))
+        self.ui.test_mean_accel.set_text(format(metrics.mean_accel, '.0f'))
+        self.ui.test_mean_decel.set_text(format(metrics.mean_decel, '.0f'))
+        self.ui.test_residual_decel.set_text(format(metrics.residual_decel, '.0f'))
+        self.ui.test_estimated_snr.set_text(format(metrics.estimated_snr, '.0f'))
+        minimum_level = format(self.linear_chart.get_minimum_level_percent(), '.1f')
+        interval = self.linear_chart.get_minimum_level_interval_percent()
+        if interval is not None:
+            minimum_level += ' ({:.1f} - {:.1f})'.format(*interval)
+        self.ui.test_minimum_level.set_text(minimum_level)
         self.ui.on_test_ready()
 
     def import_test_values(self):
-        filename = self.ui.file_chooser(_('CSV file to import'), 'open', file_type='csv')
+        filename = self.ui.file_chooser(_('Test data file to import'), 'open', file_type='test')
         if filename is None:
             return
 
-        with open(filename) as csv_file:
-            lin_input_values = []
-            lin_output_values = []
-            perf_input_values = []
-            perf_output_values = []
-            data_block = 0
-            csv_reader = csv.reader(csv_file, delimiter=',')
-            for row in csv_reader:
-                if row[0].startswith('#'):
-                    continue
-                if row[0] == 'minimum_level':
-                    self.minimum_level = row[1]
-                elif row[0] == 'linear_data':
-                    data_block = 0
-                elif row[0] == 'performance_data':
-                    data_block = 1
-                elif data_block == 0:
-                    lin_input_values.append((float(row[0]), float(row[1])))
-                    lin_output_values.append((float(row[2]), float(row[3])))
-                elif data_block == 1:
-                    perf_input_values.append((float(row[0]), float(row[1])))
-                    perf_output_values.append((float(row[2]), float(row[3])))
-
-        self.linear_chart = LinearChart(lin_input_values, lin_output_values, self.device.get_max_range())
-        self.linear_chart.set_minimum_level(self.minimum_level)
-        self.performance_chart = PerformanceChart(perf_input_values, perf_output_values, self.device.get_max_range())
+        Thread(target=self.load_test_values, args=(filename, self.device.get_max_range()), daemon=True).start()
+
+    def load_test_values(self, filename, wheel_range):
+        from .linear_chart import LinearChart
+        from .performance_chart import PerformanceChart
+        from .test_data import TestData
+        try:
+            if filename.endswith('.csv'):
+                test_data = TestData.read_csv(filename)
+            else:
+                test_data = TestData.read_capture(filename)
+            if test_data.wheel_range is not None:
+                wheel_range = test_data.wheel_range
+            linear_chart = LinearChart(test_data.get_array('linear_input'), test_data.get_array('linear_output'),
+                    wheel_range)
+            linear_chart.set_minimum_level(test_data.minimum_level, test_data.minimum_level_interval)
+            performance_chart = PerformanceChart(test_data.get_array('performance_input'),
+                    test_data.get_array('performance_output'), wheel_range)
+            performance_chart.get_metrics()
+        except (OSError, ValueError, TypeError, IndexError) as e:
+            logging.debug("load_test_values: %s", e)
+            self.ui.safe_call(self.ui.error_dialog, _("Error importing test data."), str(e))
+            return
+        self.ui.safe_call(self.apply_test_values, test_data, linear_chart, performance_chart)
+
+    def apply_test_values(self, test_data, linear_chart, performance_chart):
+        from .combined_chart import CombinedChart
+        self.test_data = test_data
+        self.minimum_level = test_data.minimum_level
+        self.minimum_level_interval = test_data.minimum_level_interval
+        self.linear_chart = linear_chart
+        self.performance_chart = performance_chart
         self.combined_chart = CombinedChart(self.linear_chart, self.performance_chart)
 
         self.show_test_results()
 
         self.ui.info_dialog(_("Test data imported."),
-            _("New test data imported from CSV file."))
+            _("New test data imported from file."))
 
     def export_test_values(self):
         if self.combined_chart is None:
             return
 
         default_filename = 'report-' + datetime.now().strftime('%Y%m%d%H%M%S') + '.csv'
-        filename = self.ui.file_chooser(_('CSV file to export'), 'save', default_filename, 'csv')
+        filename = self.ui.file_chooser(_('Test data file to export'), 'save', default_filename, 'test')
         if filename is None:
             return
 
-        with open(filename, mode='w') as csv_file:
-            csv_writer = csv.writer(csv_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-            csv_writer.writerow(['minimum_level', self.minimum_level])
-            csv_writer.writerow(['linear_data'])
-            for v1, v2 in zip(self.linear_chart.get_input_values(), self.linear_chart.get_output_values()):
-                csv_writer.writerow([format(v1[0], '.5f'), format(v1[1], '.5f'), format(v2[0], '.5f'), format(v2[1], '.5f')])
-            csv_writer.writerow(['performance_data'])
-            for v1, v2 in zip(self.performance_chart.get_input_values(), self.performance_chart.get_pos_values()):
-                csv_writer.writerow([format(v1[0], '.5f'), format(v1[1], '.5f'), format(v2[0], '.5f'), format(v2[1], '.5f')])
-
-        self.ui.info_dialog(_("Test data exported."),
-            _("Current test data has been exported to a CSV file."))
+        Thread(target=self.save_test_values, args=(filename, self.test_data, self.linear_chart,
+                self.performance_chart), daemon=True).start()
+
+    def save_test_values(self, filename, test_data, linear_chart, performance_chart):
+        from .test_data import TestData
+        try:
+            if filename.endswith('.csv'):
+                # CSV rows pair input and output samples on the resampled time grid
+                test_data.write_csv(filename,
+                        TestData.columns(linear_chart.get_input_values(), linear_chart.get_output_values()),
+                        TestData.columns(performance_chart.get_input_values(), performance_chart.get_pos_values()),
+                        performance_chart.get_metrics().items())
+            else:
+                test_data.write_capture(filename, compress=filename.endswith('.ovcapz'))
+        except OSError as e:
+            logging.debug("save_test_values: %s", e)
+            self.ui.safe_call(self.ui.error_dialog, _("Error exporting test data."), str(e))
+            return
+        self.ui.safe_call(self.ui.info_dialog, _("Test data exported."),
+            _("Current test data has been exported to a file."))
 
     def open_test_chart(self):
         if self.combined_chart is None:
@@ -0,0 +1,107 @@
+import logging
+import os
+import select
+
+class InputReactor:
+
+    def __init__(self, device_manager, callback):
+        self.device_manager = device_manager
+        self.notify = callback
+        self.epoll = select.epoll()
+        self.wakeup_write_fd = None
+        if hasattr(os, 'eventfd'):
+            self.wakeup_fd = os.eventfd(0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+        else:
+            self.wakeup_fd, self.wakeup_write_fd = os.pipe()
+            os.set_blocking(self.wakeup_fd, False)
+            os.set_blocking(self.wakeup_write_fd, False)
+        self.epoll.register(self.wakeup_fd, select.EPOLLIN)
+        self.devices = {}
+        self.running = False
+
+    def wakeup(self):
+        if self.wakeup_write_fd is None:
+            os.eventfd_write(self.wakeup_fd, 1)
+            return
+        try:
+            os.write(self.wakeup_write_fd, b'\0')
+        except BlockingIOError:
+            # The pipe is full, a wakeup is already pending
+            pass
+
+    def drain_wakeup(self):
+        try:
+            if self.wakeup_write_fd is None:
+                os.eventfd_read(self.wakeup_fd)
+            else:
+                while os.read(self.wakeup_fd, 4096):
+                    pass
+        except BlockingIOError:
+            pass
+
+    def stop(self):
+        self.running = False
+        self.wakeup()
+
+    def sync_devices(self):
+        wanted = {}
+        for device in self.device_manager.get_devices():
+            if not device.is_ready():
+                continue
+            try:
+                fd = device.get_fd()
+            except OSError as e:
+                logging.debug("InputReactor: %s: %s", device.get_id(), e)
+                continue
+            if fd is not None:
+                wanted[fd] = device
+
+        for fd, device in list(self.devices.items()):
+            if wanted.get(fd) is not device:
+                self.unregister(fd)
+
+        for fd, device in wanted.items():
+            if fd not in self.devices:
+                try:
+                    self.epoll.register(fd, select.EPOLLIN)
+                except OSError as e:
+                    logging.debug("InputReactor: %s: %s", device.get_id(), e)
+                    continue
+                self.devices[fd] = device
+                logging.debug("InputReactor: watching %s", device.get_id())
+
+    def unregister(self, fd):
+        device = self.devices.pop(fd)
+        try:
+            self.epoll.unregister(fd)
+        except (OSError, ValueError):
+            pass
+        logging.debug("InputReactor: stopped watching %s", device.get_id())
+
+    def run(self):
+        self.running = True
+        self.sync_devices()
+        while self.running:
+            for fd, mask in self.epoll.poll():
+                if fd == self.wakeup_fd:
+                    self.drain_wakeup()
+                    self.sync_devices()
+                    continue
+                device = self.devices.get(fd)
+                if device is None:
+                    continue
+                if mask & (select.EPOLLHUP | select.EPOLLERR):
+                    self.unregister(fd)
+                    continue
+                try:
+                    events = device.read_available_events()
+                except OSError as e:
+                    logging.debug(e)
+                    self.unregister(fd)
+                    continue
+                if events is not None and len(events):
+                    self.notify(device.get_id(), events)
+        self.epoll.close()
+        os.close(self.wakeup_fd)
+        if self.wakeup_write_fd is not None:
+            os.close(self.wakeup_write_fd)
@@ -1,3 +1,4 @@
+import numpy as np
 from .signal import Signal
 
 class LinearChart:
@@ -11,46 +12,49 @@ class LinearChart:
         self.veldata = self.fposdata.derive(wheelrange / 2 * 60 / 360)
         self.fveldata = self.veldata.filter(10)
 
-        self.fixed_input = Signal([(t, abs(v)) for t, v in self.input.get_values()])
-        self.linearity = Signal(self.normalize(self.input.get_values(), [(t, abs(v)) for t, v in self.fveldata.get_values()]))
+        self.fixed_input = Signal(np.abs(self.input.get_values()), times=self.input.get_times())
 
-        linearity_values = [(0, 0)]
-        periods = self.input.get_periods()
-        t0, _ = periods[1]
-        for t1, _ in periods[2:]:
-            v = self.get_max_velocity(t0, t1)
-            linearity_values.append((t1, v))
-            t0 = t1
+        period_times, _ = self.input.get_periods()
+        fvel_stats = self.fveldata.get_period_stats(period_times[1:])
+        linearity_times = np.concatenate(([0], fvel_stats.ends))
+        linearity_values = np.concatenate(([0], np.nan_to_num(fvel_stats.max)))
 
-        self.linearity = Signal(self.normalize(self.input.get_values(), linearity_values))
+        self.linearity = Signal(self.normalize(self.input.get_values(), linearity_values), times=linearity_times)
 
     def normalize(self, signal, output):
-        max_input = max([abs(v[1]) for v in signal])
-        max_output = max([abs(v[1]) for v in output])
-        return [(v[0], v[1] * max_input / max_output) for v in output]
+        max_input = np.abs(signal).max()
+        max_output = np.abs(output).max()
+        return output * max_input / max_output
 
     def get_max_velocity(self, t1, t2):
         if t1 >= t2:
             return 0
-        return max([abs(v[1]) for v in self.fveldata.slice(t1, t2)])
+        _, values = self.fveldata.slice(t1, t2)
+        return np.abs(values).max()
 
     def get_input_values(self):
-        return self.input.get_values()
+        return self.input.get_data()
 
     def get_output_values(self):
-        return self.output.get_values()
+        return self.output.get_data()
 
     def get_fixed_input_values(self):
-        return self.fixed_input.get_values()
+        return self.fixed_input.get_data()
 
     def get_linearity_values(self):
-        return self.linearity.get_values()
+        return self.linearity.get_data()
 
-    def set_minimum_level(self, minimum_level):
+    def set_minimum_level(self, minimum_level, interval = None):
         self.minimum_level = float(minimum_level)
+        self.minimum_level_interval = interval
 
     def get_minimum_level(self):
         return self.minimum_level
 
     def get_minimum_level_percent(self):
         return self.minimum_level * 100 / 0x7fff
+
+    def get_minimum_level_interval_percent(self):
+        if self.minimum_level_interval is None:
+            return None
+        return tuple(level * 100 / 0x7fff for level in self.minimum_level_interval)
@@ -1,5 +1,7 @@
 import configparser
 import logging
+import time
+from .write_coalescer import WriteCoalescer
 
 class Model:
 
@@ -40,9 +42,38 @@ class Model:
         'start_app_manually': 'boolean',
     }
 
+    # Hardware settings in the order they're applied
+    device_setters = {
+        'mode': 'set_mode',
+        'range': 'set_range',
+        'combine_pedals': 'set_combine_pedals',
+        'center_wheel': 'center_wheel',
+        'autocenter': 'set_autocenter',
+        'ff_gain': 'set_ff_gain',
+        'spring_level': 'set_spring_level',
+        'damper_level': 'set_damper_level',
+        'friction_level': 'set_friction_level',
+        'ffb_leds': 'set_ffb_leds',
+    }
+
+    # Settings changed continuously by sliders, written through the
+    # coalescer at most write_rate times per second each
+    coalesced_settings = ['range', 'ff_gain', 'autocenter', 'spring_level', 'damper_level', 'friction_level']
+
+    write_rate = 20
+
+    # Settings whose getter returns a default when the device attribute is
+    # missing, the setter uses an FF effect instead
+    write_only_settings = {
+        'autocenter': 'autocenter',
+        'ff_gain': 'gain',
+    }
+
     def __init__(self, device = None, ui = None):
         self.ui = ui
         self.reference_values = None
+        self.executor = None
+        self.coalescer = None
         self.data = self.defaults.copy()
         if device != None:
             self.set_device(device)
@@ -61,6 +92,22 @@ class Model:
     def set_ui(self, ui):
         self.ui = ui
 
+    def set_executor(self, executor):
+        # Device writes go through the executor when there's one, and are
+        # done in the calling thread otherwise
+        if executor is self.executor:
+            return
+        self.flush_writes()
+        if self.coalescer is not None:
+            self.coalescer.close()
+        self.executor = executor
+        self.coalescer = WriteCoalescer(self.submit_device_setting, self.write_rate) if executor else None
+
+    def flush_writes(self):
+        if self.coalescer is not None:
+            self.coalescer.flush()
+            self.coalescer.log_stats()
+
     def update_save_profile_button(self):
         self.ui.disable_save_profile()
         if self.ui is None or self.reference_values is None:
@@ -70,6 +117,7 @@ class Model:
                 self.ui.enable_save_profile()
 
     def read_device_settings(self):
+        capabilities = self.device.get_capabilities()
         return {
             'mode': self.device.get_mode(),
             'range': self.device.get_range(),
@@ -80,9 +128,9 @@ class Model:
             'damper_level': self.device.get_damper_level(),
             'friction_level': self.device.get_friction_level(),
             'ffb_leds': self.device.get_ffb_leds(),
-            'ffb_overlay': False if self.device.get_peak_ffb_level() is not None else None,
-            'range_overlay': 'never' if self.device.get_peak_ffb_level() is not None else None,
-            'use_buttons': False if self.device.get_range() is not None else None,
+            'ffb_overlay': False if capabilities.has_attribute('peak_ffb_level') else None,
+            'range_overlay': 'never' if capabilities.has_attribute('peak_ffb_level') else None,
+            'use_buttons': False if capabilities.has_attribute('range') else None,
             'center_wheel': False,
             'start_app_manually': False,
         }
@@ -90,6 +138,17 @@ class Model:
     def update_from_device_settings(self):
         self.data.update(self.read_device_settings())
 
+    def read_device_state(self):
+        # Tests, the command line or other tools may have changed the wheel
+        # since it was last read, so the write plan is always built from a
+        # fresh read. Values that can't be read back are None so they're
+        # always written.
+        state = self.read_device_settings()
+        for key, attribute in self.write_only_settings.items():
+            if not self.device.has_attribute(attribute):
+                state[key] = None
+        return state
+
     def get_profile(self):
         return self.profile
 
@@ -164,7 +223,7 @@ class Model:
 
     def set_mode(self, value):
         if self.set_if_changed('mode', value):
-            self.device.set_mode(value)
+            self.write_device_setting('mode', value)
 
     def get_mode(self):
         return self.data['mode']
@@ -172,7 +231,7 @@ class Model:
     def set_range(self, value):
         value = int(value)
         if self.set_if_changed('range', value):
-            self.device.set_range(value)
+            self.write_device_setting('range', value)
 
     def get_range(self):
         return self.data['range']
@@ -180,7 +239,7 @@ class Model:
     def set_ff_gain(self, value):
         value = int(value)
         if self.set_if_changed('ff_gain', value):
-            self.device.set_ff_gain(value)
+            self.write_device_setting('ff_gain', value)
 
     def get_ff_gain(self):
         return self.data['ff_gain']
@@ -188,7 +247,7 @@ class Model:
     def set_autocenter(self, value):
         value = int(value)
         if self.set_if_changed('autocenter', value):
-            self.device.set_autocenter(value)
+            self.write_device_setting('autocenter', value)
 
     def get_autocenter(self):
         return self.data['autocenter']
@@ -196,7 +255,7 @@ class Model:
     def set_combine_pedals(self, value):
         value = int(value)
         if self.set_if_changed('combine_pedals', value):
-            self.device.set_combine_pedals(value)
+            self.write_device_setting('combine_pedals', value)
 
     def get_combine_pedals(self):
         return self.data['combine_pedals']
@@ -204,7 +263,7 @@ class Model:
     def set_spring_level(self, value):
         value = int(value)
         if self.set_if_changed('spring_level', value):
-            self.device.set_spring_level(value)
+            self.write_device_setting('spring_level', value)
 
     def get_spring_level(self):
         return self.data['spring_level']
@@ -212,7 +271,7 @@ class Model:
     def set_damper_level(self, value):
         value = int(value)
         if self.set_if_changed('damper_level', value):
-            self.device.set_damper_level(value)
+            self.write_device_setting('damper_level', value)
 
     def get_damper_level(self):
         return self.data['damper_level']
@@ -220,7 +279,7 @@ class Model:
     def set_friction_level(self, value):
         value = int(value)
         if self.set_if_changed('friction_level', value):
-            self.device.set_friction_level(value)
+            self.write_device_setting('friction_level', value)
 
     def get_friction_level(self):
         return self.data['friction_level']
@@ -228,7 +287,7 @@ class Model:
     def set_ffb_leds(self, value):
         value = bool(value)
         if self.set_if_changed('ffb_leds', value):
-            self.device.set_ffb_leds(1 if value else 0)
+            self.write_device_setting('ffb_leds', value)
 
     def get_ffb_leds(self):
         return self.data['ffb_leds']
@@ -253,8 +312,8 @@ class Model:
 
     def set_center_wheel(self, value):
         value = bool(value)
-        if self.set_if_changed('center_wheel', value) and value:
-            self.device.center_wheel()
+        if self.set_if_changed('center_wheel', value):
+            self.write_device_setting('center_wheel', value)
 
     def set_start_app_manually(self, value):
         value = bool(value)
@@ -263,28 +322,72 @@ class Model:
     def get_start_app_manually(self):
         return self.data['start_app_manually']
 
+    def write_device_setting(self, key, value):
+        if self.executor is None:
+            self.apply_device_setting(key, value)
+        elif key in self.coalesced_settings:
+            self.coalescer.submit(key, value)
+        else:
+            # Keep the order with settings still waiting in the coalescer
+            self.coalescer.flush()
+            self.submit_device_setting(key, value)
+
+    def submit_device_setting(self, key, value):
+        self.executor.submit(key, self.apply_device_setting, key, value)
+
+    def apply_device_setting(self, key, value):
+        result = None
+        if key == 'center_wheel':
+            if value:
+                self.device.center_wheel()
+        elif key == 'ffb_leds':
+            result = self.device.set_ffb_leds(1 if value else 0)
+        else:
+            result = getattr(self.device, self.device_setters[key])(value)
+        return result
+
+    def build_write_plan(self):
+        device_state = self.read_device_state()
+        plan = []
+        for key in self.device_setters:
+            value = self.data[key]
+            if value is None:
+                continue
+            if key == 'center_wheel':
+                # The wheel can't report whether it's centered, only center
+                # it after changing the mode or range
+                if value and any(name in ('mode', 'range') for name, _ in plan):
+                    plan.append((key, value))
+                continue
+            if device_state[key] != value:
+                plan.append((key, value))
+        return plan
+
     def flush_device(self):
         logging.debug("flush_device")
-        if self.data['mode'] is not None:
-            self.device.set_mode(self.data['mode'])
-        if self.data['range'] is not None:
-            self.device.set_range(self.data['range'])
-        if self.data['combine_pedals'] is not None:
-            self.device.set_combine_pedals(self.data['combine_pedals'])
-        if self.data['center_wheel']:
-            self.device.center_wheel()
-        if self.data['autocenter'] is not None:
-            self.device.set_autocenter(self.data['autocenter'])
-        if self.data['ff_gain'] is not None:
-            self.device.set_ff_gain(self.data['ff_gain'])
-        if self.data['spring_level'] is not None:
-            self.device.set_spring_level(self.data['spring_level'])
-        if self.data['damper_level'] is not None:
-            self.device.set_damper_level(self.data['damper_level'])
-        if self.data['friction_level'] is not None:
-            self.device.set_friction_level(self.data['friction_level'])
-        if self.data['ffb_leds'] is not None:
-            self.device.set_ffb_leds(self.data['ffb_leds'])
+        if self.device is None:
+            return []
+        if self.executor is not None:
+            # The changes are only known once the executor gets to them
+            self.coalescer.flush()
+            self.executor.submit('flush', self.write_device_settings)
+            return None
+        return self.write_device_settings()
+
+    def write_device_settings(self):
+        start_time = time.perf_counter()
+        plan = self.build_write_plan()
+        changed = []
+        for key, value in plan:
+            self.apply_device_setting(key, value)
+            changed.append(key)
+            if not self.device.is_ready():
+                # A mode switch re-enumerated the wheel, the rest of the plan
+                # belongs to the new device
+                break
+        logging.debug("flush_device: changed [%s] in %.1f ms", ', '.join(changed),
+                (time.perf_counter() - start_time) * 1000)
+        return changed
 
     def flush_ui(self, data = None):
         logging.debug("flush_ui")
@@ -0,0 +1,162 @@
+import logging
+import os
+from . import wheel_ids as wid
+
+class WheelLookup:
+
+    # Finds the connected wheels by reading sysfs and the udev database
+    # directly, without pyudev, evdev or a udev monitor. Returns the same
+    # fields DeviceManager sets on its devices.
+
+    input_class_path = '/sys/class/input'
+    udev_data_path = '/run/udev/data'
+
+    def find_wheels(self):
+        try:
+            names = os.listdir(self.input_class_path)
+        except OSError:
+            return []
+        names = sorted((name for name in names if name.startswith('event') and name[5:].isdigit()),
+                key=lambda name: int(name[5:]))
+        wheels = []
+        for name in names:
+            wheel = self.read_wheel(name)
+            if wheel is not None:
+                wheels.append(wheel)
+        return wheels
+
+    def find_wheel(self, dev_name = None):
+        for wheel in self.find_wheels():
+            if dev_name is None or wheel['dev_name'] == dev_name:
+                return wheel
+        return None
+
+    def read_wheel(self, name):
+        sys_path = os.path.realpath(os.path.join(self.input_class_path, name))
+        properties = self.read_udev_properties(self.read_file(os.path.join(sys_path, 'dev')))
+        if properties is None or properties.get('ID_INPUT_JOYSTICK') != '1':
+            return None
+
+        vendor_id = properties.get('ID_VENDOR_ID')
+        product_id = properties.get('ID_MODEL_ID')
+        usb_id = str(vendor_id) + ':' + str(product_id)
+        if usb_id not in wid.supported_wheels:
+            return None
+
+        return {
+            'id': sys_path[len('/sys'):] if sys_path.startswith('/sys/') else sys_path,
+            'vendor_id': vendor_id,
+            'product_id': product_id,
+            'usb_id': usb_id,
+            'dev_name': properties.get('DEVNAME', '/dev/input/' + name),
+            'dev_path': os.path.realpath(os.path.join(sys_path, 'device', 'device')),
+            'phys_path': properties.get('ID_PATH'),
+            'name': bytes(properties.get('ID_VENDOR_ENC', '') + ' ' + properties.get('ID_MODEL_ENC', ''),
+                          'utf-8').decode('unicode_escape'),
+            'max_range': wid.supported_wheels[usb_id],
+        }
+
+    def read_udev_properties(self, dev_number):
+        # udev keeps the properties of character devices in c<major>:<minor>
+        if dev_number is None:
+            return None
+        try:
+            with open(os.path.join(self.udev_data_path, 'c' + dev_number)) as data_file:
+                lines = data_file.read().splitlines()
+        except OSError:
+            return None
+        properties = {}
+        for line in lines:
+            if line.startswith('E:'):
+                key, _, value = line[2:].partition('=')
+                properties[key] = value
+        return properties
+
+    @staticmethod
+    def read_file(path):
+        try:
+            with open(path) as data_file:
+                return data_file.read().strip()
+        except OSError:
+            return None
+
+class OneShot:
+
+    # Applies settings to a wheel found by WheelLookup using only its sysfs
+    # attributes. Settings that need the input device or a mode switch make
+    # plan() return None so the caller can use the full device path.
+
+    # Sysfs attribute and value conversion for each setting, in the order
+    # Model applies them
+    attributes = {
+        'range': ('range', int),
+        'combine_pedals': ('combine_pedals', int),
+        'autocenter': ('autocenter', lambda value: int(min(value, 100) / 100.0 * 65535)),
+        'ff_gain': ('gain', lambda value: int(min(value, 100) / 100.0 * 65535)),
+        'spring_level': ('spring_level', int),
+        'damper_level': ('damper_level', int),
+        'friction_level': ('friction_level', int),
+        'ffb_leds': ('ffb_leds', lambda value: 1 if value else 0),
+    }
+
+    def __init__(self, wheel):
+        self.wheel = wheel
+        self.attribute_fds = {}
+
+    def close(self):
+        for fd in self.attribute_fds.values():
+            os.close(fd)
+        self.attribute_fds = {}
+
+    def open_attribute(self, name):
+        if name not in self.attribute_fds:
+            path = os.path.join(self.wheel['dev_path'], name)
+            try:
+                self.attribute_fds[name] = os.open(path, os.O_RDWR | os.O_CLOEXEC)
+            except FileNotFoundError:
+                return None
+        return self.attribute_fds[name]
+
+    def read_attribute(self, name):
+        return os.pread(self.attribute_fds[name], 4096, 0).decode()
+
+    def get_mode(self):
+        fd = self.open_attribute('alternate_modes')
+        if fd is None:
+            return None
+        for line in self.read_attribute('alternate_modes').splitlines():
+            mode_id, _, name = line.partition(': ')
+            if mode_id != 'native' and name.endswith('*'):
+                return mode_id
+        return None
+
+    def plan(self, settings):
+        # Returns the (attribute, contents) pairs that differ from the
+        # current device state
+        if settings.get('center_wheel'):
+            return None
+        if settings.get('mode') is not None and settings['mode'] != self.get_mode():
+            return None
+
+        writes = []
+        for key, (name, convert) in self.attributes.items():
+            value = settings.get(key)
+            if value is None:
+                continue
+            if self.open_attribute(name) is None:
+                # Autocenter and gain fall back to the input device, the
+                # rest are skipped like Device does
+                if key in ('autocenter', 'ff_gain'):
+                    return None
+                continue
+            contents = str(convert(value))
+            if self.read_attribute(name).strip() != contents:
+                writes.append((name, contents.encode()))
+        return writes
+
+    def apply(self, writes):
+        # Every attribute is already open and every value encoded, so the
+        # batch is just one pwrite per changed attribute
+        for name, contents in writes:
+            os.pwrite(self.attribute_fds[name], contents, 0)
+        logging.debug("OneShot: wrote [%s]", ', '.join(name for name, _ in writes))
@@ -15,83 +15,138 @@ class PerformanceChart:
         self.acceldata = self.fveldata.derive()
         self.facceldata = self.acceldata.filter(15)
 
+        period_times, _ = self.input.get_periods()
+        self.fvel_stats = self.fveldata.get_period_stats(period_times)
+        self.faccel_stats = self.facceldata.get_period_stats(period_times)
+
+        self.metrics = None
+
     def get_input_values(self):
-        return self.input.get_values()
+        return self.input.get_data()
 
     def get_pos_values(self):
-        return self.posdata.get_values()
+        return self.posdata.get_data()
 
     def get_filtered_pos_values(self):
-        return self.fposdata.get_values()
+        return self.fposdata.get_data()
 
     def get_velocity_values(self):
-        return self.veldata.get_values()
+        return self.veldata.get_data()
 
     def get_filtered_velocity_values(self):
-        return self.fveldata.get_values()
+        return self.fveldata.get_data()
 
     def get_accel_values(self):
-        return self.acceldata.get_values()
+        return self.acceldata.get_data()
 
     def get_filtered_accel_values(self):
-        return self.facceldata.get_values()
+        return self.facceldata.get_data()
+
+    def get_metrics(self):
+        if self.metrics is None:
+            self.metrics = self.compute_metrics()
+        return self.metrics
+
+    def compute_metrics(self):
+        metrics = PerformanceMetrics()
+        t0 = self.input.get_period_start(0)
+        t1 = self.input.get_period_start(1)
+        t2 = self.input.get_period_start(2)
+        t4 = self.input.get_period_start(4)
+
+        noiselevel = self.posdata.noise_level(t0, t1)
+        times, values = self.posdata.slice(t1, t2)
+        moved = np.flatnonzero(np.abs(values - values[0]) > noiselevel)
+        if len(moved):
+            metrics.latency = times[moved[0]] - t1
+
+        metrics.max_velocity = self.fvel_stats.max[1]
+        metrics.time_to_max_velocity = self.fvel_stats.argmax[1]
+        metrics.max_accel = self.faccel_stats.max[1]
+        metrics.time_to_max_accel = self.faccel_stats.argmax[1] - t1
+
+        times, values = self.fveldata.slice(t1, t2)
+        reached = np.flatnonzero(np.abs(values) >= metrics.max_velocity)
+        if len(reached) and metrics.latency is not None:
+            metrics.mean_accel = abs(values[reached[0]]) / (times[reached[0]] - metrics.latency)
+
+        stop_time = self.fvel_stats.get_xzero_time(2)
+        if stop_time is not None and t2 < stop_time:
+            times, values = self.facceldata.slice(t2, stop_time)
+            magnitude = np.abs(values)
+            index = magnitude.argmax()
+            metrics.max_decel = magnitude[index]
+            metrics.time_to_max_decel = times[index] - t2
+            metrics.mean_decel = metrics.max_velocity / (stop_time - t2)
+
+        stop_time = self.fvel_stats.get_xzero_time(4)
+        if stop_time is None:
+            stop_time = self.input.get_period_start(5)
+        _, values = self.facceldata.slice(t4, min(t4 + 0.2, stop_time))
+        metrics.residual_decel = abs(np.mean(values))
+
+        metrics.estimated_snr = self.posdata.estimated_snr(self.fposdata)
+        return metrics
 
     def get_latency(self):
-        noiselevel = self.posdata.noise_level(*self.input.get_range(0, 1))
-        posdata = self.posdata.slice(*self.input.get_range(1, 2))
-        v0 = posdata[0][1]
-        for t, v in posdata:
-            if abs(v - v0) > noiselevel:
-                return t - self.input.get_period_start(1)
-        return None
+        return self.get_metrics().latency
 
     def get_max_velocity(self):
-        return max([abs(v[1]) for v in self.fveldata.slice(*self.input.get_range(1, 2))])
+        return self.get_metrics().max_velocity
 
     def get_time_to_max_velocity(self):
-        return max(self.fveldata.slice(*self.input.get_range(1, 2)), key = lambda i : abs(i[1]))[0]
+        return self.get_metrics().time_to_max_velocity
 
     def get_max_accel(self):
-        return max([abs(v[1]) for v in self.facceldata.slice(*self.input.get_range(1, 2))])
+        return self.get_metrics().max_accel
 
     def get_time_to_max_accel(self):
-        return max(self.facceldata.slice(*self.input.get_range(1, 2)), key = lambda i : abs(i[1]))[0] - self.input.get_period_start(1)
+        return self.get_metrics().time_to_max_accel
 
     def get_max_decel(self):
-        t1 = self.input.get_period_start(2)
-        t2 = self.fveldata.xzero_time(*self.input.get_range(2, 3))
-        if t1 >= t2:
-            return 0
-        return max([abs(v[1]) for v in self.facceldata.slice(t1, t2)])
+        return self.get_metrics().max_decel
 
     def get_time_to_max_decel(self):
-        t1 = self.input.get_period_start(2)
-        t2 = self.fveldata.xzero_time(*self.input.get_range(2, 3))
-        if t1 >= t2:
-            return 0
-        return max(self.facceldata.slice(t1, t2), key = lambda i : abs(i[1]))[0] - t1
+        return self.get_metrics().time_to_max_decel
 
     def get_mean_accel(self):
-        max_velocity = self.get_max_velocity()
-        for t, v in self.fveldata.slice(*self.input.get_range(1, 2)):
-            if abs(v) >= max_velocity:
-                return abs(v) / (t - self.get_latency())
-        return None
+        return self.get_metrics().mean_accel
 
     def get_mean_decel(self):
-        t1 = self.input.get_period_start(2)
-        t2 = self.fveldata.xzero_time(*self.input.get_range(2, 3))
-        if t1 >= t2:
-            return 0
-        return self.get_max_velocity() / (t2 - t1)
+        return self.get_metrics().mean_decel
 
     def get_residual_decel(self):
-        t1 = self.input.get_period_start(4)
-        t2 = self.fveldata.xzero_time(*self.input.get_range(4, 5))
-        if t2 is None:
-            t2 = self.input.get_period_start(5)
-        t2 = min(t1 + 0.2, t2)
-        return abs(np.mean([v[1] for v in self.facceldata.slice(t1, t2)]))
+        return self.get_metrics().residual_decel
 
     def get_estimated_snr(self):
-        return self.posdata.estimated_snr(self.fposdata)
+        return self.get_metrics().estimated_snr
+
+class PerformanceMetrics:
+
+    def __init__(self):
+        self.latency = None
+        self.max_velocity = None
+        self.time_to_max_velocity = None
+        self.mean_accel = None
+        self.mean_decel = 0
+        self.max_accel = None
+        self.time_to_max_accel = None
+        self.max_decel = 0
+        self.time_to_max_decel = 0
+        self.residual_decel = None
+        self.estimated_snr = None
+
+    def items(self):
+        return [
+            ('latency', self.latency),
+            ('max_velocity', self.max_velocity),
+            ('time_to_max_velocity', self.time_to_max_velocity),
+            ('mean_accel', self.mean_accel),
+            ('mean_decel', self.mean_decel),
+            ('max_accel', self.max_accel),
+            ('time_to_max_accel', self.time_to_max_accel),
+            ('max_decel', self.max_decel),
+            ('time_to_max_decel', self.time_to_max_decel),
+            ('residual_decel', self.residual_decel),
+            ('estimated_snr', self.estimated_snr),
+        ]
@@ -0,0 +1,50 @@
+from evdev import ecodes
+import time
+
+class SettleDetector:
+
+    # Polls the device axis state, which the input reader keeps up to date,
+    # and reports when the wheel has stopped moving
+
+    poll_interval = 0.005
+
+    def __init__(self, device, code = ecodes.ABS_X, band = 64, velocity_band = 2000, hold_time = 0.15):
+        self.axis_state = device.get_axis_state()
+        self.code = code
+        # Maximum drift in axis units around the settled position
+        self.band = band
+        # Maximum speed in axis units per second between two polls
+        self.velocity_band = velocity_band
+        self.hold_time = hold_time
+
+    def wait_settled(self, timeout, min_time = 0):
+        # Returns True once position and velocity have stayed within their
+        # bands for hold_time, False if the timeout is reached first
+        start_time = time.monotonic()
+        now = start_time
+        anchor = previous = self.axis_state.get(self.code)
+        anchor_time = previous_time = start_time
+        while now - start_time < timeout:
+            time.sleep(self.poll_interval)
+            now = time.monotonic()
+            position = self.axis_state.get(self.code)
+            velocity = abs(position - previous) / (now - previous_time)
+            previous = position
+            previous_time = now
+            if abs(position - anchor) > self.band or velocity > self.velocity_band:
+                anchor = position
+                anchor_time = now
+            elif now - anchor_time >= self.hold_time and now - start_time >= min_time:
+                return True
+        return False
+
+    def wait_moved(self, timeout):
+        # Returns True as soon as the position leaves the band around its
+        # starting value, False if the timeout is reached first
+        start_time = time.monotonic()
+        start_position = self.axis_state.get(self.code)
+        while time.monotonic() - start_time < timeout:
+            time.sleep(self.poll_interval)
+            if abs(self.axis_state.get(self.code) - start_position) > self.band:
+                return True
+        return False
@@ -1,119 +1,197 @@
 import math
-from scipy.ndimage.filters import uniform_filter1d
+import numpy as np
+from scipy.ndimage import uniform_filter1d
+
+class PeriodStats:
+
+    def __init__(self, starts, ends, maximum, argmax, mean, xzero):
+        self.starts = starts
+        self.ends = ends
+        # Maximum absolute value and the time it was reached
+        self.max = maximum
+        self.argmax = argmax
+        self.mean = mean
+        # Time of the first zero crossing, NaN if there isn't one
+        self.xzero = xzero
+
+    def get_xzero_time(self, num):
+        t = self.xzero[num]
+        return None if math.isnan(t) else t
 
 class Signal:
 
-    def __init__(self, values, periods = False, resample = False):
-        if resample:
-            self.values = self.resample(values)
+    resample_step = 0.001
+
+    def __init__(self, values, periods = False, resample = False, times = None, step = None):
+        if times is None:
+            data = np.asarray(values, dtype=np.float64).reshape(-1, 2)
+            times = data[:, 0]
+            values = data[:, 1]
         else:
-            self.values = values
+            times = np.asarray(times, dtype=np.float64)
+            values = np.asarray(values, dtype=np.float64)
+
+        if resample:
+            times, values = self.resample(times, values)
+            step = self.resample_step
+
+        self.times = times
+        self.values = values
+        # Sample spacing when times are a uniform grid starting at 0
+        self.step = step
 
         if periods:
-            self.periods = [self.values[0]]
-            t0, v0 = self.values[0]
-            t = None
-            v = None
-            for t, v in self.values:
-                if v - v0 != 0:
-                    self.periods.append((t, v))
-                    v0 = v
-                    t0 = t
-            if t is not None and t != t0:
-                self.periods.append((t, v))
+            # A new period starts every time the value changes
+            starts = np.concatenate(([0], np.flatnonzero(np.diff(self.values)) + 1))
+            if len(self.times) > 1 and self.times[-1] != self.times[starts[-1]]:
+                starts = np.append(starts, len(self.times) - 1)
+            self.period_times = self.times[starts]
+            self.period_values = self.values[starts]
+
+    def get_times(self):
+        return self.times
 
     def get_values(self):
         return self.values
 
+    def get_data(self):
+        return self.times, self.values
+
     def get_value(self, t):
         return self.values[int(t * 1000)]
 
-    def resample(self, data):
-        newdata = []
-        new_t = 0
-        t0 = 0
-        v0 = 0
-        for t, v in data:
-            if t > 0:
-                new_t = math.ceil(t * 1000)
-                if new_t > t0:
-                    length = new_t - t0
-                    for delta_time in range(0, length):
-                        newdata.append(((t0 + delta_time) / 1000, v0))
-            t0 = new_t
-            v0 = v
-
-        return newdata
+    def get_index(self, t):
+        if self.step is None:
+            return int(np.searchsorted(self.times, t, side='left'))
+        count = len(self.times)
+        index = min(max(math.ceil(t / self.step - 1e-6), 0), count)
+        # Correct the rounding of the grid arithmetic
+        if index > 0 and self.times[index - 1] >= t:
+            index -= 1
+        elif index < count and self.times[index] < t:
+            index += 1
+        return index
+
+    def get_indexes(self, times):
+        times = np.asarray(times, dtype=np.float64)
+        if self.step is None:
+            return np.searchsorted(self.times, times, side='left')
+        count = len(self.times)
+        indexes = np.clip(np.ceil(times / self.step - 1e-6), 0, count).astype(np.int64)
+        if count == 0:
+            return indexes
+        previous = self.times[np.clip(indexes - 1, 0, count - 1)]
+        indexes -= (indexes > 0) & (previous >= times)
+        current = self.times[np.clip(indexes, 0, count - 1)]
+        indexes += (indexes < count) & (current < times)
+        return indexes
+
+    def resample(self, times, values):
+        # Zero-order hold on a 1 ms grid
+        if len(times) == 0:
+            return times, values
+        steps = np.where(times > 0, np.ceil(times * 1000), 0)
+        steps = np.maximum.accumulate(steps).astype(np.int64)
+        grid = np.arange(steps[-1])
+        indexes = np.searchsorted(steps, grid, side='right') - 1
+        newvalues = np.where(indexes >= 0, values[np.maximum(indexes, 0)], 0)
+        return grid / 1000, newvalues
 
     def get_period_start(self, num):
-        return self.periods[num][0]
+        return self.period_times[num]
 
     def get_range(self, p1, p2):
         return (self.get_period_start(p1), self.get_period_start(p2))
 
     def get_periods(self):
-        return self.periods
+        return self.period_times, self.period_values
+
+    def get_period_stats(self, boundaries, offset = 0):
+        # Reduce every [boundaries[i], boundaries[i + 1]) range in one pass,
+        # boundaries must be increasing
+        boundaries = np.asarray(boundaries, dtype=np.float64)
+        if len(boundaries) < 2:
+            nothing = np.zeros(0)
+            return PeriodStats(nothing, nothing, nothing, nothing, nothing, nothing)
+        indexes = self.get_indexes(boundaries)
+        starts = indexes[:-1]
+        ends = indexes[1:]
+        empty = starts == ends
+        count = len(self.values)
+
+        # A trailing sentinel keeps reduceat indexes in range for the last period
+        positions = np.arange(count + 1)
+        values = np.append(self.values, 0)
+        magnitude = np.abs(values)
+        segments = np.searchsorted(indexes, positions, side='right') - 1
+        inside = (segments >= 0) & (segments < len(starts))
+        segments = np.clip(segments, 0, max(len(starts) - 1, 0))
+        bounds = np.column_stack((starts, ends)).ravel()
+
+        maximum = np.maximum.reduceat(magnitude, bounds)[::2]
+        total = np.add.reduceat(values, bounds)[::2]
+
+        at_max = inside & (magnitude == maximum[segments])
+        first_max = np.minimum.reduceat(np.where(at_max, positions, count), bounds)[::2]
+
+        # Same rule as xzero(): the value before the first sample counts as 0
+        shifted = values + offset
+        previous = np.concatenate(([0], shifted[:-1]))
+        previous[starts[starts < count]] = 0
+        crossing = inside & ((shifted == 0) | (shifted * previous < 0))
+        first_xzero = np.minimum.reduceat(np.where(crossing, positions, count), bounds)[::2]
+
+        times = np.append(self.times, np.nan)
+        return PeriodStats(
+            boundaries[:-1],
+            boundaries[1:],
+            np.where(empty, np.nan, maximum),
+            np.where(empty, np.nan, times[first_max]),
+            np.where(empty, np.nan, total / np.maximum(ends - starts, 1)),
+            np.where(empty, np.nan, times[first_xzero]),
+        )
 
     def derive(self, multiplier = 1):
-        newdata = [(0, 0)]
-        v0 = None
-        t0 = None
-        for t, v in self.values:
-            if v0 is not None:
-                newval = (v - v0) * multiplier / (t - t0)
-                newdata.append((t, newval))
-            v0 = v
-            t0 = t
-        return Signal(newdata)
+        if len(self.times) == 0:
+            return Signal(np.zeros(1), times=np.zeros(1))
+        times = np.concatenate(([0], self.times[1:]))
+        values = np.concatenate(([0], np.diff(self.values) * multiplier / np.diff(self.times)))
+        return Signal(values, times=times, step=self.step)
 
     def filter(self, average_size):
-        (times, values) = zip(*self.values)
-        #times = [t / 1000 for t in range(0, average_size // 2)] + [t + average_size // 2 / 1000 for t in times]
-        #values = [values[0] for v in range(0, average_size // 2)] + list(values)
-        filtered_data = uniform_filter1d(values, size=average_size, mode='nearest')
-        newdata = list(zip(times, filtered_data))
-        return Signal(newdata)
+        filtered_data = uniform_filter1d(self.values, size=average_size, mode='nearest')
+        return Signal(filtered_data, times=self.times, step=self.step)
 
     def slice(self, t1, t2):
-        return [v for v in self.values if t1 <= v[0] < t2]
+        i1 = self.get_index(t1)
+        i2 = max(self.get_index(t2), i1)
+        return self.times[i1:i2], self.values[i1:i2]
 
     def noise_level(self, t1, t2):
-        minv = 1
-        maxv = -1
-        sumv = 0
-        count = 0
-        for _, v in self.slice(t1, t2):
-            sumv += v
-            if v < minv:
-                minv = v
-            if v > maxv:
-                maxv = v
-            count += 1
-        mean = sumv / count
-
+        _, values = self.slice(t1, t2)
+        mean = values.mean()
+        minv = min(1, values.min())
+        maxv = max(-1, values.max())
         return max(mean - minv, maxv - mean)
 
     def xzero(self, t1, t2, offset = 0):
-        data = self.slice(t1, t2)
-        v0 = 0
-        for t, v in data:
-            if v + offset == 0 or (v + offset) * v0 < 0:
-                return (t, v)
-            v0 = v + offset
-        return (None, None)
+        times, values = self.slice(t1, t2)
+        shifted = values + offset
+        previous = np.concatenate(([0], shifted[:-1]))
+        crossings = np.flatnonzero((shifted == 0) | (shifted * previous < 0))
+        if len(crossings) == 0:
+            return (None, None)
+        return (times[crossings[0]], values[crossings[0]])
 
     def xzero_time(self, t1, t2, offset = 0):
         xzero_value = self.xzero(t1, t2, offset)
         return xzero_value[0]
 
     def estimated_snr(self, filtered_signal):
-        noise = 0
-        signal = 0
-        count = 0
-        for _, v in filtered_signal.get_values():
-            noise += math.pow(v - self.values[count][1], 2)
-            signal += math.pow(v, 2)
-            count += 1
+        filtered_values = filtered_signal.get_values()
+        count = len(filtered_values)
+        noise = np.sum(np.square(filtered_values - self.values[:count]))
+        signal = np.sum(np.square(filtered_values))
         if noise == 0:
             return 30
         return 10 * math.log10(math.sqrt(signal / count) / math.sqrt(noise / count))
@@ -0,0 +1,63 @@
+import math
+
+class Staircase:
+
+    # 1-up/1-down staircase: the level goes down after every detected pulse
+    # and up after every missed one. The step is halved at each reversal so
+    # the search narrows like a bisection, and the threshold is estimated
+    # from the levels where the direction reversed.
+
+    def __init__(self, start_level, start_step, min_step = 30, min_level = 0, max_level = 0x7fff,
+            max_reversals = 8, max_trials = 40, discard_reversals = 2):
+        self.level = start_level
+        self.step = start_step
+        self.min_step = min_step
+        self.min_level = min_level
+        self.max_level = max_level
+        self.max_reversals = max_reversals
+        self.max_trials = max_trials
+        self.discard_reversals = discard_reversals
+        self.direction = None
+        self.reversals = []
+        self.trials = []
+
+    def get_level(self):
+        return self.level
+
+    def is_done(self):
+        if len(self.reversals) >= self.max_reversals or len(self.trials) >= self.max_trials:
+            return True
+        # Still missing at full force, there's nothing left to search
+        return self.trials[-1] == (self.max_level, False) if self.trials else False
+
+    def add_response(self, detected):
+        self.trials.append((self.level, detected))
+        direction = -1 if detected else 1
+        if self.direction is not None and direction != self.direction:
+            self.reversals.append(self.level)
+            self.step = max(self.step // 2, self.min_step)
+        self.direction = direction
+        self.level = min(max(self.level + direction * self.step, self.min_level), self.max_level)
+
+    def get_reversal_levels(self):
+        if len(self.reversals) > self.discard_reversals + 1:
+            return self.reversals[self.discard_reversals:]
+        return self.reversals
+
+    def get_estimate(self):
+        levels = self.get_reversal_levels()
+        if not levels:
+            detected = [level for level, response in self.trials if response]
+            return min(detected) if detected else self.max_level
+        return sum(levels) / len(levels)
+
+    def get_confidence_interval(self, z = 1.96):
+        levels = self.get_reversal_levels()
+        estimate = self.get_estimate()
+        if len(levels) < 2:
+            # Not enough reversals for a spread, use the final step size
+            return (max(estimate - self.step, self.min_level), min(estimate + self.step, self.max_level))
+        mean = sum(levels) / len(levels)
+        variance = sum((level - mean) ** 2 for level in levels) / (len(levels) - 1)
+        margin = z * math.sqrt(variance / len(levels))
+        return (max(estimate - margin, self.min_level), min(estimate + margin, self.max_level))
@@ -0,0 +1,41 @@
+import logging
+import os
+import time
+
+class StartupTimer:
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.exec_elapsed = self.get_exec_elapsed()
+        self.marks = []
+
+    @staticmethod
+    def get_exec_elapsed():
+        # Seconds since the process was started, with clock tick resolution
+        try:
+            with open('/proc/self/stat') as stat_file:
+                stat = stat_file.read()
+            start_ticks = int(stat[stat.rindex(')') + 2:].split()[19])
+            return time.clock_gettime(time.CLOCK_BOOTTIME) - start_ticks / os.sysconf('SC_CLK_TCK')
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def mark(self, name):
+        self.marks.append((name, time.perf_counter()))
+
+    def elapsed(self):
+        # Time since exec when known, since the timer was created otherwise
+        elapsed = time.perf_counter() - self.start_time
+        if self.exec_elapsed is not None:
+            elapsed += self.exec_elapsed
+        return elapsed
+
+    def report(self):
+        if self.exec_elapsed is not None:
+            logging.debug("Startup: %.1f ms interpreter and imports before the application started",
+                    self.exec_elapsed * 1000)
+        previous = self.start_time
+        for name, mark_time in self.marks:
+            logging.debug("Startup: %.1f ms %s", (mark_time - previous) * 1000, name)
+            previous = mark_time
+        logging.debug("Startup: %.1f ms total", self.elapsed() * 1000)
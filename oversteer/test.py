@@ -1,17 +1,38 @@
-from evdev import ecodes, ff
+from evdev import ecodes
+import logging
 import numpy as np
 from threading import Thread
 import time
+from .capture import Capture
+from .effect_pool import EffectPool
+from .effect_scheduler import EffectScheduler
+from .settle_detector import SettleDetector
+from .staircase import Staircase
 
 class Test:
 
+    # CPU to pin the capture thread to, None to let the scheduler decide
+    capture_cpu = None
+    capture_realtime = True
+
+    staircase_start_level = 0x1000
+    staircase_start_step = 0x800
+    staircase_response_time = 0.5
+
     def __init__(self, device, callback):
         self.device = device
         self.input_device = self.device.get_input_device()
         self.notify = callback
         self.collecting_data = False
+        self.capture = None
+        self.schedule_stats = None
+        self.effect_pool = None
+        self.effect_stats = None
+        self.settle_detector = SettleDetector(device)
         self.awaiting_action = False
+        self.cancelled = False
         self.minimum_level = 0
+        self.minimum_level_interval = None
 
     def get_input_values(self):
         return self.input_values
@@ -22,6 +43,20 @@ class Test:
     def get_minimum_level(self):
         return self.minimum_level
 
+    def get_minimum_level_interval(self):
+        return self.minimum_level_interval
+
+    def get_effect_stats(self):
+        return self.effect_stats
+
+    def get_schedule_stats(self):
+        return self.schedule_stats
+
+    def get_capture_stats(self):
+        if self.capture is None:
+            return None
+        return self.capture.get_stats()
+
     def is_collecting_data(self):
         return self.collecting_data
 
@@ -31,9 +66,15 @@ class Test:
     def trigger_action(self):
         self.action_triggered = True
 
+    def cancel(self):
+        # Makes a test waiting for the user give up, its effects are erased
+        # when the test thread ends
+        self.cancelled = True
+
     def start(self):
         self.input_values = []
         self.output_values = []
+        self.schedule_stats = None
 
         # Save wheel settings
         self.current_range = self.device.get_range()
@@ -41,11 +82,7 @@ class Test:
         self.current_autocenter = self.device.get_autocenter()
 
         # Prepare wheel
-        try:
-            for effect_id in range(self.input_device.ff_effects_count):
-                self.input_device.erase_effect(effect_id)
-        except OSError:
-            pass
+        self.effect_pool = EffectPool(self.input_device, self.device.get_capabilities().get_ff_effects_count())
 
         self.device.set_range(900)
         self.device.set_ff_gain(100)
@@ -57,61 +94,69 @@ class Test:
         self.device.set_ff_gain(self.current_ff_gain)
         self.device.set_autocenter(self.current_autocenter)
 
-    def create_left_effect(self, level = 0x7fff):
-        left_effect = ff.Effect(
-            ecodes.FF_CONSTANT, -1, 0x4000,
-            ff.Trigger(0, 0),
-            ff.Replay(0, 0),
-            ff.EffectType(ff_constant_effect=ff.Constant(level=level))
-        )
-        left_effect.id = self.input_device.upload_effect(left_effect)
-        return left_effect
-
-    def create_right_effect(self, level = 0x7fff):
-        right_effect = ff.Effect(
-            ecodes.FF_CONSTANT, -1, 0xc000,
-            ff.Trigger(0, 0),
-            ff.Replay(0, 0),
-            ff.EffectType(ff_constant_effect=ff.Constant(level=level))
-        )
-        right_effect.id = self.input_device.upload_effect(right_effect)
-        return right_effect
-
-    def update_effect(self, effect):
-        self.input_device.upload_effect(effect)
-
-    def erase_effect(self, effect):
-        self.input_device.erase_effect(effect.id)
-
     def run(self, test_id):
         if test_id == 0:
-            Thread(target=self.test1, daemon=True).start()
+            Thread(target=self.run_test, args=(self.test1,), daemon=True).start()
         elif test_id == 1:
-            Thread(target=self.test2, daemon=True).start()
+            Thread(target=self.run_test, args=(self.test2,), daemon=True).start()
         elif test_id == 2:
-            Thread(target=self.test3,).start()
+            Thread(target=self.run_test, args=(self.test3,)).start()
 
-    def append_data(self, timestamp, value):
-        if self.collecting_data is False:
-            return
-        self.output_values.append((timestamp - self.test_starttime, (value - 32768) / 32768))
+    def run_test(self, test):
+        try:
+            test()
+        finally:
+            # A test that raised or was cancelled leaves its effects
+            # uploaded, erase them before this Test is dropped
+            if self.effect_pool is not None:
+                self.effect_pool.close()
+                self.effect_pool = None
+
+    def finish_schedule(self, scheduler):
+        scheduler.log_stats()
+        self.schedule_stats = scheduler.get_stats()
+        scheduler.close()
+
+    def finish_effects(self, test_id):
+        self.effect_pool.close()
+        stats = self.effect_pool.get_stats()
+        if self.schedule_stats is not None:
+            stats['writes'] += self.schedule_stats['steps']
+        self.effect_stats = stats
+        logging.debug("Test %d: %d effect uploads, %d in-place updates, %d erases, %d play/stop writes",
+                test_id, stats['uploads'], stats['updates'], stats['erases'], stats['writes'])
+        self.effect_pool = None
+
+    def start_capture(self):
+        self.capture = Capture(self.device, ecodes.ABS_X, self.capture_cpu, self.capture_realtime)
+        self.capture.start()
+        self.collecting_data = True
+
+    def stop_capture(self):
+        self.collecting_data = False
+        self.capture.stop()
+        times, values = self.capture.get_data()
+        data = np.column_stack((times - self.test_starttime, (values - 32768) / 32768))
+        self.output_values = np.concatenate((self.output_values, data))
 
     def seed_axis_position(self):
         # Move the wheel a bit to start collecting data
-        effect = self.create_left_effect(0x2000)
-        self.input_device.write(ecodes.EV_FF, effect.id, 1)
-        time.sleep(0.1)
-        self.input_device.write(ecodes.EV_FF, effect.id, 0)
-        self.erase_effect(effect)
+        effect_id = self.effect_pool.get_id(EffectPool.LEFT, 0x2000)
+        self.effect_pool.play(effect_id)
+        self.settle_detector.wait_moved(0.3)
+        self.effect_pool.stop(effect_id)
 
     def center_wheel(self):
-        # Center wheel
+        # Center wheel, give the spring some time to engage before looking
+        # for the wheel to stop
         self.device.set_autocenter(100)
-        time.sleep(1)
+        if not self.settle_detector.wait_settled(3, min_time=0.2):
+            logging.debug("Test: wheel didn't settle while centering")
         self.device.set_autocenter(0)
 
         # Wait for wheel to stabilize and all events to arrive
-        time.sleep(0.5)
+        if not self.settle_detector.wait_settled(1):
+            logging.debug("Test: wheel didn't settle after centering")
 
     # Minimum torque test
     def test1(self):
@@ -122,33 +167,38 @@ class Test:
         self.action_triggered = False
         self.awaiting_action = True
         while not self.action_triggered:
+            if self.cancelled:
+                self.awaiting_action = False
+                self.stop()
+                return
             time.sleep(0.5)
         self.action_triggered = False
         self.notify('running')
 
-        left_effect = self.create_left_effect(0)
-        right_effect = self.create_right_effect(0)
-        self.input_device.write(ecodes.EV_FF, left_effect.id, 1)
-        self.input_device.write(ecodes.EV_FF, right_effect.id, 1)
-
-        # Increasing force square effect
-        for level in range(0, 0x7fff, 30):
-            left_effect.u.ff_constant_effect.level = level
-            self.update_effect(left_effect)
+        # Pulse left and right, then give the user some time to react. The
+        # level goes down after every pulse felt and up after every miss.
+        staircase = Staircase(self.staircase_start_level, self.staircase_start_step)
+        while not staircase.is_done():
+            level = staircase.get_level()
+            left_id = self.effect_pool.get_id(EffectPool.LEFT, level)
+            right_id = self.effect_pool.get_id(EffectPool.RIGHT, level)
+            self.action_triggered = False
+            self.effect_pool.play(left_id)
             time.sleep(0.1)
-            left_effect.u.ff_constant_effect.level = 0
-            self.update_effect(left_effect)
-            right_effect.u.ff_constant_effect.level = level
-            self.update_effect(right_effect)
+            self.effect_pool.stop(left_id)
+            self.effect_pool.play(right_id)
             time.sleep(0.1)
-            right_effect.u.ff_constant_effect.level = 0
-            self.update_effect(right_effect)
-            if self.action_triggered:
-                self.minimum_level = level
-                break
+            self.effect_pool.stop(right_id)
+            time.sleep(self.staircase_response_time)
+            staircase.add_response(self.action_triggered)
+            logging.debug("Staircase: level %d %s", level, 'felt' if self.action_triggered else 'missed')
 
-        self.erase_effect(left_effect)
-        self.erase_effect(right_effect)
+        self.minimum_level = int(round(staircase.get_estimate()))
+        self.minimum_level_interval = staircase.get_confidence_interval()
+        logging.debug("Staircase: minimum level %d (%.0f - %.0f) after %d pulses", self.minimum_level,
+                *self.minimum_level_interval, len(staircase.trials))
+
+        self.finish_effects(0)
 
         # Stop test
         self.awaiting_action = False
@@ -162,48 +212,44 @@ class Test:
         self.seed_axis_position()
         self.center_wheel()
 
-        left_effect = self.create_left_effect(0)
-        right_effect = self.create_right_effect(0)
+        # Alternate right and left steps of increasing force
+        steps = []
+        direction = EffectPool.RIGHT
+        for level in np.arange(0, 0x8000, 0x7fff / 50):
+            steps.append((direction, int(round(level))))
+            direction = -direction
+        self.effect_pool.prepare(steps)
 
         # Set the starting points for the test
         starting_wheel_pos = (self.device.get_last_axis_value(ecodes.ABS_X) - 32768) / 32768
         self.input_values = [(0, 0)]
-        self.output_values = [(0, starting_wheel_pos)]
-        self.test_starttime = time.time()
-        time.sleep(0.1)
+        self.output_values = np.array([(0, starting_wheel_pos)])
+        scheduler = EffectScheduler(self.input_device)
+        self.test_starttime = scheduler.start()
 
         # Start collecting data
-        self.collecting_data = True
-
-        direction = 1
-        for level in np.arange(0, 0x8000, 0x7fff / 50):
-            level = int(round(level))
-
-            if direction == 1:
-                # Move wheel right
-                right_effect.u.ff_constant_effect.level = level
-                self.update_effect(right_effect)
-                self.input_device.write(ecodes.EV_FF, right_effect.id, 1)
-                self.input_values.append((time.time() - self.test_starttime, level / 0x7fff))
-                time.sleep(0.3)
-                self.input_device.write(ecodes.EV_FF, right_effect.id, 0)
-            else:
-                # Move wheel left
-                left_effect.u.ff_constant_effect.level = level
-                self.update_effect(left_effect)
-                self.input_device.write(ecodes.EV_FF, left_effect.id, 1)
-                self.input_values.append((time.time() - self.test_starttime, -level / 0x7fff))
-                time.sleep(0.3)
-                self.input_device.write(ecodes.EV_FF, left_effect.id, 0)
-            direction = 3 - direction
-
-        self.input_values.append((time.time() - self.test_starttime, 0))
-
-        # Stop collecting data
-        self.collecting_data = False
-
-        self.erase_effect(left_effect)
-        self.erase_effect(right_effect)
+        self.start_capture()
+        try:
+            # Each step starts when the previous one stops, effects that didn't
+            # fit in the device are uploaded while the previous step plays
+            step_time = 0.1
+            previous_id = None
+            for direction, level in steps:
+                effect_id = self.effect_pool.get_id(direction, level)
+                if previous_id is not None:
+                    scheduler.stop(previous_id, step_time, 'stop')
+                t = scheduler.play(effect_id, step_time, 'level {}'.format(direction * level))
+                self.input_values.append((t, direction * level / 0x7fff))
+                previous_id = effect_id
+                step_time += 0.3
+
+            t = scheduler.stop(previous_id, step_time, 'stop')
+            self.input_values.append((t, 0))
+        finally:
+            # Stop collecting data
+            self.stop_capture()
+        self.finish_schedule(scheduler)
+        self.finish_effects(1)
 
         # Notify application the test is done
         self.notify()
@@ -213,47 +259,46 @@ class Test:
         self.seed_axis_position()
         self.center_wheel()
 
-        left_effect = self.create_left_effect()
-        right_effect = self.create_right_effect()
+        left_id = self.effect_pool.get_id(EffectPool.LEFT, 0x7fff)
+        right_id = self.effect_pool.get_id(EffectPool.RIGHT, 0x7fff)
 
         # Set the starting points for the test
         starting_wheel_pos = (self.device.get_last_axis_value(ecodes.ABS_X) - 32768) / 32768
         self.input_values = [(0, 0)]
-        self.output_values = [(0, starting_wheel_pos)]
-        self.test_starttime = time.time()
-        time.sleep(0.1)
+        self.output_values = np.array([(0, starting_wheel_pos)])
+        scheduler = EffectScheduler(self.input_device)
+        self.test_starttime = scheduler.start()
 
         # Start collecting data
-        self.collecting_data = True
-
-        # Move wheel right at top speed
-        self.input_values.append((time.time() - self.test_starttime, 1))
-        self.input_device.write(ecodes.EV_FF, right_effect.id, 1)
-        time.sleep(0.3)
-        self.input_device.write(ecodes.EV_FF, right_effect.id, 0)
-
-        # Move wheel left at top speed
-        self.input_values.append((time.time() - self.test_starttime, -1))
-        self.input_device.write(ecodes.EV_FF, left_effect.id, 1)
-        time.sleep(0.3)
-        self.input_device.write(ecodes.EV_FF, left_effect.id, 0)
-
-        # Move wheel right at top speed
-        self.input_values.append((time.time() - self.test_starttime, 1))
-        self.input_device.write(ecodes.EV_FF, right_effect.id, 1)
-        time.sleep(0.3)
-        self.input_device.write(ecodes.EV_FF, right_effect.id, 0)
-        self.input_values.append((time.time() - self.test_starttime, 0))
-
-        # Keep collecting deceleration data
-        time.sleep(0.5)
-        self.input_values.append((time.time() - self.test_starttime, 0))
-
-        # Stop collecting data
-        self.collecting_data = False
-
-        self.erase_effect(left_effect)
-        self.erase_effect(right_effect)
+        self.start_capture()
+        try:
+            # Move wheel right at top speed
+            t = scheduler.play(right_id, 0.1, 'right')
+            self.input_values.append((t, 1))
+
+            # Move wheel left at top speed
+            scheduler.stop(right_id, 0.4, 'stop')
+            t = scheduler.play(left_id, 0.4, 'left')
+            self.input_values.append((t, -1))
+
+            # Move wheel right at top speed
+            scheduler.stop(left_id, 0.7, 'stop')
+            t = scheduler.play(right_id, 0.7, 'right')
+            self.input_values.append((t, 1))
+
+            t = scheduler.stop(right_id, 1.0, 'stop')
+            self.input_values.append((t, 0))
+
+            # Keep collecting deceleration data until the wheel stops, at least
+            # as long as the residual deceleration window
+            if not self.settle_detector.wait_settled(2, min_time=0.2):
+                logging.debug("Test: wheel didn't settle after the last step")
+            self.input_values.append((scheduler.elapsed(), 0))
+        finally:
+            # Stop collecting data
+            self.stop_capture()
+        self.finish_schedule(scheduler)
+        self.finish_effects(2)
 
         # Notify application the test is done
         self.notify()
@@ -0,0 +1,162 @@
+import json
+import numpy as np
+import re
+import struct
+import zlib
+
+class TestData:
+
+    # Raw input/output arrays of a full test session plus the settings and
+    # results needed to analyze it again.
+    #
+    # Capture files start with a fixed header (magic, version, JSON header
+    # size) followed by the JSON header and the arrays. Every array starts
+    # at a 64 byte aligned offset, so uncompressed arrays are loaded with
+    # np.memmap without copying.
+
+    magic = b'OVSTCAP\0'
+    version = 1
+    alignment = 64
+    prefix = struct.Struct('<8sII')
+    array_names = ['linear_input', 'linear_output', 'performance_input', 'performance_output']
+
+    def __init__(self, arrays = None, minimum_level = 0, minimum_level_interval = None, device_id = None,
+            wheel_range = None, metadata = None):
+        self.arrays = {}
+        for name, values in (arrays or {}).items():
+            self.set_array(name, values)
+        self.minimum_level = minimum_level
+        self.minimum_level_interval = minimum_level_interval
+        self.device_id = device_id
+        self.wheel_range = wheel_range
+        self.metadata = metadata if metadata is not None else {}
+
+    def set_array(self, name, values):
+        self.arrays[name] = np.asarray(values, dtype=np.float64).reshape(-1, 2)
+
+    def get_array(self, name):
+        return self.arrays.get(name)
+
+    def is_complete(self):
+        return all(name in self.arrays for name in self.array_names)
+
+    def write_capture(self, filename, compress = False):
+        header = {
+            'device_id': self.device_id,
+            'wheel_range': self.wheel_range,
+            'minimum_level': self.minimum_level,
+            'minimum_level_interval': self.minimum_level_interval,
+            'metadata': self.metadata,
+            'arrays': {},
+        }
+        blobs = []
+        for name, values in self.arrays.items():
+            data = np.ascontiguousarray(values, dtype='<f8').tobytes()
+            if compress:
+                data = zlib.compress(data)
+            header['arrays'][name] = {
+                'dtype': '<f8',
+                'shape': list(values.shape),
+                'compression': 'zlib' if compress else None,
+                'size': len(data),
+            }
+            blobs.append((name, data))
+
+        # Offsets depend on the header size, which depends on the offsets
+        offset = 0
+        while True:
+            header_bytes = json.dumps(header).encode()
+            position = self.align(self.prefix.size + len(header_bytes))
+            for name, data in blobs:
+                header['arrays'][name]['offset'] = position
+                position = self.align(position + len(data))
+            if position == offset:
+                break
+            offset = position
+
+        with open(filename, 'wb') as capture_file:
+            capture_file.write(self.prefix.pack(self.magic, self.version, len(header_bytes)))
+            capture_file.write(header_bytes)
+            for name, data in blobs:
+                capture_file.seek(header['arrays'][name]['offset'])
+                capture_file.write(data)
+            capture_file.truncate(offset)
+
+    def align(self, position):
+        return (position + self.alignment - 1) // self.alignment * self.alignment
+
+    @classmethod
+    def read_capture(cls, filename):
+        with open(filename, 'rb') as capture_file:
+            magic, version, header_size = cls.prefix.unpack(capture_file.read(cls.prefix.size))
+            if magic != cls.magic:
+                raise ValueError("Not an Oversteer capture file")
+            if version > cls.version:
+                raise ValueError("Unsupported capture file version: {}".format(version))
+            header = json.loads(capture_file.read(header_size))
+
+            arrays = {}
+            for name, info in header['arrays'].items():
+                shape = tuple(info['shape'])
+                if info['compression'] is None:
+                    arrays[name] = np.memmap(filename, dtype=info['dtype'], mode='r', offset=info['offset'],
+                            shape=shape)
+                elif info['compression'] == 'zlib':
+                    capture_file.seek(info['offset'])
+                    data = zlib.decompress(capture_file.read(info['size']))
+                    arrays[name] = np.frombuffer(data, dtype=info['dtype']).reshape(shape)
+                else:
+                    raise ValueError("Unsupported compression: {}".format(info['compression']))
+
+        data = cls(None, header['minimum_level'], header['minimum_level_interval'], header['device_id'],
+                header['wheel_range'], header['metadata'])
+        # Keep the memory mapped arrays as they are
+        data.arrays = arrays
+        return data
+
+    def write_csv(self, filename, linear_columns, performance_columns, metrics = None):
+        with open(filename, 'w') as csv_file:
+            csv_file.write('minimum_level,{}\n'.format(self.minimum_level))
+            for name, value in (metrics or []):
+                csv_file.write('# {},{}\n'.format(name, '' if value is None else format(value, '.5f')))
+            csv_file.write('linear_data\n')
+            np.savetxt(csv_file, linear_columns, fmt='%.5f', delimiter=',')
+            csv_file.write('performance_data\n')
+            np.savetxt(csv_file, performance_columns, fmt='%.5f', delimiter=',')
+
+    @classmethod
+    def read_csv(cls, filename):
+        with open(filename) as csv_file:
+            text = csv_file.read()
+
+        # Only the marker lines are looked at in Python, the data blocks
+        # between them are parsed by numpy in one go
+        markers = sorted((match.start(), match.end(), match.group(1))
+                for match in re.finditer(r'^(linear_data|performance_data)[,\s]*$', text, re.M))
+        header_end = markers[0][0] if markers else len(text)
+        match = re.search(r'^minimum_level,([^,\n]*)', text[:header_end], re.M)
+        minimum_level = float(match.group(1)) if match else 0
+
+        data = cls(minimum_level=minimum_level)
+        for index, (_, end, name) in enumerate(markers):
+            block_end = markers[index + 1][0] if index + 1 < len(markers) else len(text)
+            values = cls.parse_columns(text[end:block_end])
+            prefix = 'linear' if name == 'linear_data' else 'performance'
+            data.set_array(prefix + '_input', values[:, 0:2])
+            data.set_array(prefix + '_output', values[:, 2:4])
+        return data
+
+    @staticmethod
+    def columns(input_data, output_data):
+        input_times, input_values = input_data
+        output_times, output_values = output_data
+        count = min(len(input_times), len(output_times))
+        return np.column_stack((input_times[:count], input_values[:count], output_times[:count],
+                output_values[:count]))
+
+    @staticmethod
+    def parse_columns(block):
+        block = block.strip()
+        if not block:
+            return np.zeros((0, 4))
+        return np.fromstring(block.replace('\n', ','), dtype=np.float64, sep=',').reshape(-1, 4)
@@ -43,3 +43,45 @@ TM_TSXW = '044f:b692'
 TS_PC  = '044f:b689'
 XX_FFBOARD = '1209:ffb0'
 
+# Maximum rotation range of every supported wheel
+supported_wheels = {
+    CM_C5: 1080,
+    FT_CSL_DD: 1080,
+    FT_CSL_ELITE: 1080,
+    FT_CSL_ELITE_PS4: 1080,
+    FT_CSV25: 900,
+    FT_CSV2: 900,
+    FT_PDD1: 1080,
+    FT_PDD2: 1080,
+    LG_DF: 270,
+    LG_DFGT: 900,
+    LG_DFP: 900,
+    LG_G25: 900,
+    LG_G27: 900,
+    LG_G29: 900,
+    LG_G920: 900,
+    LG_G923P: 900,
+    LG_G923X: 900,
+    LG_GPRO: 1080,
+    LG_MOMO2: 270,
+    LG_MOMO: 270,
+    LG_SFW: 270,
+    LG_WFF: 180,
+    LG_WFFG: 180,
+    LG_WFG: 180,
+    TM_F458: 240,
+    TM_FFRW: 180,
+    TM_T150: 1080,
+    TM_T248: 900,
+    TM_T300RS: 1080,
+    TM_T300RS_FF1: 1080,
+    TM_T300RS_GT: 1080,
+    TM_T500RS: 1080,
+    TM_T80: 240,
+    TM_T80H: 240,
+    TM_TMX: 900,
+    TM_TSXW: 1080,
+    TS_PC: 1080,
+    TM_TX: 900,
+    XX_FFBOARD: 1080,
+}
@@ -0,0 +1,91 @@
+import logging
+from threading import Condition, Thread
+import time
+
+class WriteCoalescer:
+
+    # Limits how often each key is written. A change after a quiet period is
+    # written right away, changes within 1 / max_rate of the last write only
+    # keep the newest value, which is written when the interval ends by a
+    # single worker thread started on the first deferred write.
+
+    def __init__(self, write, max_rate = 20):
+        self.write = write
+        self.interval = 1 / max_rate
+        self.condition = Condition()
+        self.thread = None
+        self.closed = False
+        self.last_write = {}
+        self.pending = {}
+        self.deadlines = {}
+        self.writes = 0
+        self.suppressed = {}
+
+    def submit(self, key, value):
+        with self.condition:
+            if key in self.pending:
+                # Replaces a value that was never written
+                self.pending[key] = value
+                self.suppressed[key] = self.suppressed.get(key, 0) + 1
+                return
+            deadline = self.last_write.get(key, float('-inf')) + self.interval
+            if deadline > time.monotonic():
+                self.pending[key] = value
+                self.deadlines[key] = deadline
+                if self.thread is None:
+                    self.thread = Thread(target=self.run, name='WriteCoalescer', daemon=True)
+                    self.thread.start()
+                self.condition.notify()
+                return
+            self.write_now(key, value)
+
+    def write_now(self, key, value):
+        self.last_write[key] = time.monotonic()
+        self.writes += 1
+        self.write(key, value)
+
+    def run(self):
+        with self.condition:
+            while not self.closed:
+                if not self.deadlines:
+                    self.condition.wait()
+                    continue
+                now = time.monotonic()
+                due = [key for key, deadline in self.deadlines.items() if deadline <= now]
+                if not due:
+                    self.condition.wait(min(self.deadlines.values()) - now)
+                    continue
+                for key in due:
+                    del self.deadlines[key]
+                    self.write_now(key, self.pending.pop(key))
+
+    def flush(self):
+        # Writes every pending value now, in the order they were submitted
+        with self.condition:
+            self.deadlines.clear()
+            pending = self.pending
+            self.pending = {}
+            for key, value in pending.items():
+                self.write_now(key, value)
+
+    def close(self):
+        # Writes every pending value and stops the worker
+        self.flush()
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def get_stats(self):
+        with self.condition:
+            return {
+                'writes': self.writes,
+                'suppressed': dict(self.suppressed),
+            }
+
+    def log_stats(self):
+        stats = self.get_stats()
+        logging.debug("WriteCoalescer: %d writes, %d suppressed %s", stats['writes'],
+                sum(stats['suppressed'].values()), stats['suppressed'])